@@ -28,6 +28,11 @@ class DaemonService(rpyc.Service):
             sentences = json.loads(sentences_json)
             return json.dumps(text_vectorizer.compute_text_embedding(sentences))
 
+    def exposed_compute_text_embeddings(self, documents_json):
+        if text_vectorizer is not None:
+            documents = json.loads(documents_json)
+            return json.dumps(text_vectorizer.compute_text_embeddings(documents))
+
     def exposed_search(self, text_query: str, path=False, top_k=10, score=False):
         if text_vectorizer is not None:
             return text_vectorizer.search(text_query, path, top_k, score)
@@ -40,6 +45,11 @@ class DaemonService(rpyc.Service):
         if image_vectorizer is not None:
             return json.dumps(image_vectorizer.encode_image(path).tolist())
 
+    def exposed_encode_images(self, paths_json):
+        if image_vectorizer is not None:
+            paths = json.loads(paths_json)
+            return json.dumps(image_vectorizer.encode_images(paths).tolist())
+
     def exposed_search_image(self, text_query: str, path=False, top_k=10, score=False):
         if image_vectorizer is not None:
             return image_vectorizer.search_image(text_query, path, top_k, score)
@@ -75,11 +85,11 @@ class AutoImportHandler(FileSystemEventHandler):
         ht = HyperTag()
         if file_id is None and path.is_file:  # Add new file
             print("AutoImportHandler - Adding file:", path)
-            ht.add(str(path))
-            import_path_dirs = set(str(self.import_path).split("/"))
-            print("AutoImportHandler - Adding tags...")
-            ht.auto_add_tags_from_path(path, import_path_dirs)
-            ht.db.conn.commit()
+            with ht.db.commit_context():
+                ht.add(str(path), commit=False)
+                import_path_dirs = set(str(self.import_path).split("/"))
+                print("AutoImportHandler - Adding tags...")
+                ht.auto_add_tags_from_path(path, import_path_dirs)
             ht.mount(ht.root_dir)
             if self.auto_index_images:
                 ht.index_images()
@@ -96,7 +106,7 @@ class AutoImportHandler(FileSystemEventHandler):
             # Add possible new tags
             import_path_dirs = set(str(event.src_path).split("/"))
             ht.auto_add_tags_from_path(path, import_path_dirs, verbose=True, keep_all=True)
-            ht.db.conn.commit()
+            ht.db.commit()
             # Remount
             ht.mount(ht.root_dir)
 
@@ -113,11 +123,11 @@ class AutoImportHandler(FileSystemEventHandler):
 
             ht = HyperTag()
             print("AutoImportHandler - Adding file:", path)
-            ht.add(str(path))
-            import_path_dirs = set(str(self.import_path).split("/"))
-            print("AutoImportHandler - Adding tags...")
-            ht.auto_add_tags_from_path(path, import_path_dirs)
-            ht.db.conn.commit()
+            with ht.db.commit_context():
+                ht.add(str(path), commit=False)
+                import_path_dirs = set(str(self.import_path).split("/"))
+                print("AutoImportHandler - Adding tags...")
+                ht.auto_add_tags_from_path(path, import_path_dirs)
             ht.mount(ht.root_dir)
             if self.auto_index_images:
                 ht.index_images()
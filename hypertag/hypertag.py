@@ -1,9 +1,11 @@
 import os
 import re
-from typing import Set
+from typing import List, Set
 from shutil import rmtree, move
 import sqlite3
 import json
+from collections import defaultdict
+from contextlib import nullcontext
 from multiprocessing import Pool
 from pathlib import Path
 import fire  # type: ignore
@@ -12,7 +14,7 @@ import rpyc  # type: ignore
 #from pywebcopy import WebPage, config  # type: ignore
 from .persistor import Persistor
 from .graph import graph
-from .utils import remove_dir, remove_symlink, download_url
+from .utils import remove_dir, remove_symlink, download_url, walk_visible_files, write_lines
 from .__init__ import __version__  # type: ignore
 
 
@@ -53,7 +55,7 @@ class HyperTag:
 
     def index_images(self, rebuild=False):
         """Vectorize image files (needed for semantic search)"""
-        from .vectorizer import CLIPVectorizer, get_image_files
+        from .vectorizer import CLIPVectorizer, get_image_files, encode_vector
 
         if rebuild:
             print("Rebuilding images index")
@@ -75,14 +77,21 @@ class HyperTag:
         if not remote:
             img_vectorizer = CLIPVectorizer(verbose=1)
 
-        for file_path in tqdm(compatible_files):
-            if remote:
-                img_vector = json.loads(rpc.root.encode_image(file_path))[0]
-            else:
-                img_vector = img_vectorizer.encode_image(file_path)[0].tolist()
-
-            self.db.add_file_embedding_vector(file_path, json.dumps(img_vector))
-            self.db.conn.commit()
+        vector_dtype = self.db.get_vector_dtype()
+        batch_size = 64  # Images encoded per model call (committed together)
+        with tqdm(total=len(compatible_files)) as t:
+            for start in range(0, len(compatible_files), batch_size):
+                batch = compatible_files[start : start + batch_size]
+                if remote:
+                    img_vectors = json.loads(rpc.root.encode_images(json.dumps(batch)))
+                else:
+                    img_vectors = img_vectorizer.encode_images(batch).tolist()
+                for file_path, img_vector in zip(batch, img_vectors):
+                    self.db.add_file_embedding_vector(
+                        file_path, encode_vector(img_vector, vector_dtype)
+                    )
+                self.db.commit()
+                t.update(len(batch))
         print("Updating image index...")
         if remote:
             rpc.root.update_image_index()
@@ -92,7 +101,12 @@ class HyperTag:
     def index_texts(self, rebuild=False, cache=False, cores: int = 0):
         """Vectorize text files (needed for semantic search)"""
         # TODO: auto index on file addition (import)
-        from .vectorizer import TextVectorizer, extract_clean_text, get_text_documents
+        from .vectorizer import (
+            TextVectorizer,
+            extract_clean_text,
+            get_text_documents,
+            encode_vector,
+        )
 
         print("Vectorizing text documents...")
         remote = True
@@ -115,47 +129,77 @@ class HyperTag:
         compatible_files = get_text_documents(file_paths, verbose=True)
         min_words = 5
         min_word_length = 4
+        inference_tuples = []
+        clean_texts = []
+        # Use saved cleaned texts if available (cache), only the other files go to the workers
+        # TODO: Evaluate thoroughly if storing all tokens is worth it
+        # Hunch: Yes, we can store text tokens and a single mapping (token : word)
+        cached_file_paths = set()
+        if cache:
+            for file_path, sentences_string in self.db.get_clean_texts_of_files(
+                [file_path for file_path, _file_type in compatible_files]
+            ):
+                cached_file_paths.add(file_path)
+                sentences = [s.split(" ") for s in json.loads(sentences_string)]
+                if sentences:
+                    inference_tuples.append((file_path, sentences))
         args = []
         for file_path, file_type in compatible_files:
-            args.append((file_path, file_type, cache, min_words, min_word_length))
-        inference_tuples = []
+            if file_path not in cached_file_paths:
+                args.append((file_path, file_type, cache, min_words, min_word_length))
 
         # Preprocess using multi-processing (default uses all available cores)
         if cores <= 0:
             n_cores = os.cpu_count()
         else:
             n_cores = cores
-        pool = Pool(processes=n_cores)
+        # Hand out tasks in chunks (~4 per core) to amortize pickling / IPC per file
+        chunk_size = max(1, len(args) // (n_cores * 4))
         print(f"Preprocessing texts using {n_cores} cores...")
-        with tqdm(total=len(compatible_files)) as t:
-            for file_path, sentences in pool.imap_unordered(extract_clean_text, args):
+        with Pool(processes=n_cores) as pool, tqdm(total=len(args)) as t:
+            for file_path, sentences, clean_text in pool.imap_unordered(
+                extract_clean_text, args, chunksize=chunk_size
+            ):
                 t.update(1)
+                if clean_text is not None:
+                    clean_texts.append((file_path, clean_text))
                 if sentences:
                     inference_tuples.append((file_path, sentences))
+        self.db.add_clean_texts(clean_texts)
         print(f"Cleaned {len(inference_tuples)} text doc/s successfully")
         print("Starting inference...")
         # Compute embeddings
         if not remote:
             vectorizer = TextVectorizer(verbose=True)
-        for file_path, sentences in tqdm(inference_tuples):
-            if remote:
-                document_vector = json.loads(rpc.root.compute_text_embedding(json.dumps(sentences)))
-            else:
-                document_vector = vectorizer.compute_text_embedding(sentences)
-            if (
-                document_vector is not None
-                and type(document_vector) is list
-                and len(document_vector) > 0
-            ):
-                self.db.add_file_embedding_vector(file_path, json.dumps(document_vector))
-                self.db.add_text(file_path, ". ".join([" ".join(s) for s in sentences]))
-                self.db.conn.commit()
-                i += 1
-            else:
-                print(type(document_vector))
-                self.db.add_file_embedding_vector(file_path, json.dumps([]))
-                self.db.conn.commit()
-                print("Failed to parse file - skipping:", file_path)
+        vector_dtype = self.db.get_vector_dtype()
+        batch_size = 64  # Documents encoded per model call (committed together)
+        with tqdm(total=len(inference_tuples)) as t:
+            for start in range(0, len(inference_tuples), batch_size):
+                batch = inference_tuples[start : start + batch_size]
+                documents = [sentences for _file_path, sentences in batch]
+                if remote:
+                    document_vectors = json.loads(
+                        rpc.root.compute_text_embeddings(json.dumps(documents))
+                    )
+                else:
+                    document_vectors = vectorizer.compute_text_embeddings(documents)
+                for (file_path, sentences), document_vector in zip(batch, document_vectors):
+                    if (
+                        document_vector is not None
+                        and type(document_vector) is list
+                        and len(document_vector) > 0
+                    ):
+                        self.db.add_file_embedding_vector(
+                            file_path, encode_vector(document_vector, vector_dtype)
+                        )
+                        self.db.add_text(file_path, ". ".join([" ".join(s) for s in sentences]))
+                        i += 1
+                    else:
+                        print(type(document_vector))
+                        self.db.add_file_embedding_vector(file_path, json.dumps([]))
+                        print("Failed to parse file - skipping:", file_path)
+                self.db.commit()
+                t.update(len(batch))
         print(f"Vectorized {str(i)} file/s successfully")
         print("Updating text index...")
         if remote:
@@ -232,6 +276,10 @@ class HyperTag:
         """Set path for HyperTagFS directory"""
         self.db.set_hypertagfs_dir(path)
 
+    def set_vector_dtype(self, vector_dtype: str):
+        """Set storage precision of new embedding vectors: fp16 (default), fp32 or int8"""
+        self.db.set_vector_dtype(vector_dtype)
+
     def mount(self, root_dir=None, parent_tag_id=None):
         """Generate HyperTagFS: tag representation using symlinks"""
         if root_dir is None:
@@ -243,23 +291,42 @@ class HyperTag:
             graph()
             os.makedirs(root_path / "Search Texts", exist_ok=True)
             os.makedirs(root_path / "Search Images", exist_ok=True)
-            tag_ids_names = self.db.get_root_tag_ids_names()
-            parent_file_paths_names = None
-        else:
-            tag_ids_names = self.db.get_tag_id_children_ids_names(parent_tag_id)
-            parent_file_paths_names = set(
-                self.db.get_file_paths_names_by_tag_id_shallow(parent_tag_id)
-            )
 
+        # Load the whole tag tree and tag files once, then walk it in memory
+        children_ids_names = defaultdict(list)
+        for parent_id, tag_id, name in self.db.get_full_tag_tree():
+            children_ids_names[parent_id].append((tag_id, name))
+        tags_file_paths_names = defaultdict(set)
+        for tag_id, file_path, file_name in self.db.get_all_tag_files():
+            tags_file_paths_names[tag_id].add((file_path, file_name))
         leaf_tag_ids = {tag_id[0] for tag_id in self.db.get_leaf_tag_ids()}
-        dupes = dict()
-        for tag_id, name in tag_ids_names:
-            child_file_paths_names = set(self.db.get_file_paths_names_by_tag_id_shallow(tag_id))
-            if parent_file_paths_names is None:
-                file_paths_names = child_file_paths_names
-            else:  # Intersect parent files with child
-                file_paths_names = parent_file_paths_names.intersection(child_file_paths_names)
-            if len(file_paths_names) > 0:
+        use_dir_fd = os.symlink in os.supports_dir_fd and os.readlink in os.supports_dir_fd
+
+        if parent_tag_id is None:
+            stack = [(root_path, self.db.get_root_tag_ids_names(), None, frozenset())]
+        else:
+            stack = [
+                (
+                    root_path,
+                    children_ids_names[parent_tag_id],
+                    tags_file_paths_names[parent_tag_id],
+                    frozenset([parent_tag_id]),
+                )
+            ]
+        while stack:
+            root_path, tag_ids_names, parent_file_paths_names, ancestor_ids = stack.pop()
+            for tag_id, name in tag_ids_names:
+                if tag_id in ancestor_ids:  # Metatag cycle
+                    continue
+                child_file_paths_names = tags_file_paths_names[tag_id]
+                if parent_file_paths_names is None:
+                    file_paths_names = child_file_paths_names
+                else:  # Intersect parent files with child
+                    file_paths_names = parent_file_paths_names.intersection(
+                        child_file_paths_names
+                    )
+                if len(file_paths_names) == 0:
+                    continue
                 underscore_root_tag_path = root_path / ("_" + name)
                 root_tag_path = root_path / name
                 if not root_tag_path.exists():
@@ -269,24 +336,50 @@ class HyperTag:
                 if tag_id not in leaf_tag_ids:
                     symlink_path = root_tag_path / "_files"
                     os.makedirs(symlink_path, exist_ok=True)
-                for file_path, file_name in file_paths_names:
-                    try:
-                        filepath = Path(file_path)
-                        current_symlink_path = symlink_path / file_name
-                        if current_symlink_path.exists() and current_symlink_path.is_symlink():
-                            existing_target = current_symlink_path.resolve()  # Get symlink target
-                            if str(existing_target) != str(filepath):  # Duplicate?
-                                dupe_i = dupes.get(current_symlink_path)
-                                if dupe_i is None:
-                                    dupes[current_symlink_path] = 1
-                                    dupe_i = 2
-                                dupes[current_symlink_path] += 1
-                                current_symlink_path = symlink_path / (f"{dupe_i}-" + file_name)
-
-                        os.symlink(filepath, current_symlink_path)
-                    except FileExistsError:
-                        pass
-                self.mount(root_tag_path, tag_id)
+                # List mounted entries once instead of probing every symlink path
+                with os.scandir(symlink_path) as it:
+                    mounted_symlinks = {entry.name: entry.is_symlink() for entry in it}
+                # Resolve link names relative to an open directory fd (skips path lookups)
+                if use_dir_fd:
+                    dir_fd = os.open(symlink_path, os.O_RDONLY | os.O_DIRECTORY)
+                    link_dir = ""
+                else:
+                    dir_fd = None
+                    link_dir = str(symlink_path) + os.sep
+                dupes = dict()
+                try:
+                    for file_path, file_name in file_paths_names:
+                        link_name = file_name
+                        if link_name in mounted_symlinks:
+                            if not mounted_symlinks[link_name]:
+                                continue  # Name taken by a non symlink entry
+                            if os.readlink(link_dir + link_name, dir_fd=dir_fd) == file_path:
+                                continue  # Already mounted
+                            # Duplicate file name
+                            dupe_i = dupes.get(file_name)
+                            if dupe_i is None:
+                                dupes[file_name] = 1
+                                dupe_i = 2
+                            dupes[file_name] += 1
+                            link_name = f"{dupe_i}-" + file_name
+                            if link_name in mounted_symlinks:
+                                continue
+                        try:
+                            os.symlink(file_path, link_dir + link_name, dir_fd=dir_fd)
+                            mounted_symlinks[link_name] = True  # Later files see it as taken
+                        except FileExistsError:
+                            pass
+                finally:
+                    if dir_fd is not None:
+                        os.close(dir_fd)
+                stack.append(
+                    (
+                        root_tag_path,
+                        children_ids_names[tag_id],
+                        child_file_paths_names,
+                        ancestor_ids | {tag_id},
+                    )
+                )
 
     def auto_add_tags_from_path(
         self, file_path: Path, import_path_dirs: Set[str], verbose=False, keep_all=False
@@ -294,6 +387,10 @@ class HyperTag:
         file_path_tags = [p for p in str(file_path).split("/") if p not in import_path_dirs]
         if not keep_all:
             file_path_tags = file_path_tags[:-1]
+        self.add_path_tags(file_path, file_path_tags, verbose)
+
+    def add_path_tags(self, file_path: Path, file_path_tags: List[str], verbose=False):
+        # Tag file with path tags, each path tag is metatagged with its preceding one
         if verbose:
             print("Inferred tags:", file_path_tags)
         self.tag(
@@ -311,35 +408,31 @@ class HyperTag:
     def import_tags(self, import_path: str, only_tags=False, verbose=False):
         """Import files with tags inferred from existing directory hierarchy
         (ignores hidden directories)"""
-        file_paths = [p for p in list(Path(import_path).rglob("*")) if p.is_file()]
-        # Remove files in hidden directories or in ignore list
+        # Skip hidden directories and those in ignore list without descending into them
         ignore_list = set(self.db.get_ignore_list())
-        visible_file_paths = []
-        for p in file_paths:
-            is_hidden = False
-            for pp in str(p).split("/"):
-                if pp.startswith(".") or pp in ignore_list:
-                    is_hidden = True
-            if not is_hidden:
-                visible_file_paths.append(p)
-        print("Adding files...")
-        if only_tags:
-            added_file_paths = visible_file_paths
-        else:
-            added_file_paths = self.add(*visible_file_paths)
-        import_path_dirs = set(str(Path(import_path).resolve()).split("/")[:-1])
-        print("import_path_dirs", import_path_dirs)
-        print("Adding tags...")
-        for file_path in tqdm(added_file_paths):
-            self.auto_add_tags_from_path(file_path, import_path_dirs, verbose)
-        self.db.conn.commit()
+        visible_file_paths = list(walk_visible_files(import_path, ignore_list))
+        with self.db.commit_context():  # One transaction (a single sync on WAL)
+            print("Adding files...")
+            if only_tags:
+                added_file_paths = visible_file_paths
+            else:
+                added_file_paths = self.add(*visible_file_paths, commit=False)
+            # Path tags: import dir name followed by the file's relative parent dirs
+            import_root = Path(import_path)
+            import_root_tags = [import_root.resolve().name] if import_root.resolve().name else []
+            print("Adding tags...")
+            for file_path in tqdm(added_file_paths):
+                relative_dirs = Path(file_path).relative_to(import_root).parts[:-1]
+                file_path = Path(os.path.abspath(file_path))  # Files are stored by absolute path
+                self.add_path_tags(file_path, import_root_tags + list(relative_dirs), verbose)
         self.mount(self.root_dir)
 
     def remove(self, *file_names):
         """Remove files"""
-        for file_name in tqdm(file_names):
-            self.db.remove_file(file_name)
-            remove_symlink(self.root_dir, file_name)
+        with self.db.commit_context():
+            for file_name in tqdm(file_names):
+                self.db.remove_file(file_name)
+                remove_symlink(self.root_dir, file_name)
         self.mount(self.root_dir)
 
     def scrape(self, url, folder, timeout=1):
@@ -371,9 +464,10 @@ class HyperTag:
             download_url(url, file_path)
             return file_path
 
-    def add(self, *paths):
+    def add(self, *paths, commit=True):
         """Add file/s or URL/s"""
         added = []
+        abs_paths = dict()  # Absolute file path -> given path
         for path in tqdm(paths):
             try:
                 if str(path).startswith("http"):
@@ -381,11 +475,12 @@ class HyperTag:
                     self.db.add_file(os.path.abspath(file_path))
                     added.append(path)
                 elif Path(path).is_file():
-                    self.db.add_file(os.path.abspath(path))
-                    added.append(path)
+                    abs_paths.setdefault(os.path.abspath(path), path)
             except sqlite3.IntegrityError:
                 pass
-        self.db.conn.commit()
+        added += [abs_paths[p] for p in self.db.add_files_bulk(list(abs_paths))]
+        if commit:
+            self.db.commit()
         print("Added", len(added), "new file/s")
         return added
 
@@ -399,15 +494,15 @@ class HyperTag:
 
     def show(self, mode="tags", path=False, print_=True):
         """Display all tags (default), indexed files (mode=index) or files"""
+        stream = bool(print_)
         if mode == "files":
-            names = self.db.get_files(path)
+            names = self.db.get_files(path, stream=stream)
         elif mode == "index":
-            names = self.db.get_vectorized_file_paths(path)
+            names = self.db.get_vectorized_file_paths(path, stream=stream)
         elif mode == "tags":
-            names = self.db.get_tags()
+            names = self.db.get_tags(stream=stream)
         if print_:
-            for name in names:
-                print(name)
+            write_lines(names)
         else:
             return names
 
@@ -420,15 +515,9 @@ class HyperTag:
         """
         # TODO: Parse AST to support queries with brackets
         operands = {"and", "or", "minus"}
-        tag_val = query[0].split("=")
-        if len(tag_val) == 1:
-            tag_query, value = (query[0], None)
-        else:
-            tag_query, value = (tag_val[0], tag_val[-1])
-            value = value.replace("*", "%")
-        results = set(self.db.get_files_by_tag(tag_query, path, fuzzy, value, verbose))
-        current_operand = None
-        for query_symbol in query[1:]:
+        tag_queries = []
+        current_operand = "and"  # and (intersection) is default operand
+        for query_symbol in query:
             if query_symbol not in operands:
                 tag_val = query_symbol.split("=")
                 if len(tag_val) == 1:
@@ -436,16 +525,12 @@ class HyperTag:
                 else:
                     tag_query, value = (tag_val[0], tag_val[-1])
                     value = value.replace("*", "%")
-                file_names = set(self.db.get_files_by_tag(tag_query, path, fuzzy, value, verbose))
-                if current_operand == "or":
-                    results = results.union(file_names)
-                elif current_operand == "minus":
-                    results = results - file_names
-                else:
-                    # and (intersection) is default operand
-                    results = results.intersection(file_names)
+                tag_queries.append((current_operand, tag_query, value))
             else:
                 current_operand = query_symbol
+        if not tag_queries:
+            return set()
+        results = set(self.db.get_files_by_tag_query(tag_queries, path, fuzzy, verbose))
         return results
 
     def tag(self, *args, remount=True, add=True, commit=True):
@@ -467,17 +552,19 @@ class HyperTag:
                 else:
                     tags.append((tag_val[0], tag_val[-1]))
         if add:
-            self.add(*file_paths)
+            self.add(*file_paths, commit=False)
         # Add tags to files
-        for file_path in file_paths:
-            for tag, value in tags:
-                self.db.add_tag_to_file(tag, str(file_path), value)
-                parent_tag_ids = self.db.get_parent_tag_ids_by_name(tag)
+        tags_files = []
+        for tag, value in tags:
+            parent_tag_ids = self.db.get_parent_tag_ids_by_name(tag)
+            for file_path in file_paths:
+                tags_files.append((tag, str(file_path), value))
                 # Add parent tags to file
                 for parent_tag_id in parent_tag_ids:
-                    self.db.add_tag_to_file(parent_tag_id, str(file_path))
+                    tags_files.append((parent_tag_id, str(file_path), None))
+        self.db.add_tags_to_files(tags_files)
         if commit:
-            self.db.conn.commit()
+            self.db.commit()
         # Remount (everything is mounted)
         if remount:
             self.mount(self.root_dir)
@@ -496,14 +583,13 @@ class HyperTag:
                 file_names.append(arg)
             else:
                 tags.append(arg)
-        # Remove tags
-        for file_name in file_names:
-            file_name = file_name.split("/")[-1]
-            for tag in tags:
-                self.db.remove_tag_from_file(tag, file_name)
-            # print("Tagged", file_name, "with", tags)
-        if commit:
-            self.db.conn.commit()
+        # Remove tags (committed once, or left to the caller's commit_context)
+        with self.db.commit_context() if commit else nullcontext():
+            for file_name in file_names:
+                file_name = file_name.split("/")[-1]
+                for tag in tags:
+                    self.db.remove_tag_from_file(tag, file_name)
+                # print("Tagged", file_name, "with", tags)
         # TODO: Remove symlink (get all paths from metatags)
         # Remount (everything is mounted)
         if remount:
@@ -540,15 +626,17 @@ class HyperTag:
 
             # Add tags to files
             file_paths = self.db.get_files_by_tag(tag, show_path=True, fuzzy=True)
+            parent_tag_ids = self.db.get_parent_tag_ids_by_name(tag)
+            tags_files = []
             for file_path in file_paths:
-                self.db.add_tag_to_file(tag, str(file_path))
-                parent_tag_ids = self.db.get_parent_tag_ids_by_name(tag)
+                tags_files.append((tag, str(file_path), None))
                 # Add parent tags to file
                 for parent_tag_id in parent_tag_ids:
-                    self.db.add_tag_to_file(parent_tag_id, str(file_path))
+                    tags_files.append((parent_tag_id, str(file_path), None))
+            self.db.add_tags_to_files(tags_files)
 
         if commit:
-            self.db.conn.commit()
+            self.db.commit()
 
         for tag in tags:
             for parent_tag in parent_tags:
@@ -618,6 +706,7 @@ def main():
         "q": ht.query,
         "set_hypertagfs_dir": ht.set_hypertagfs_dir,
         "add_auto_import_dir": ht.add_auto_import_dir,
+        "set_vector_dtype": ht.set_vector_dtype,
         "mount": ht.mount,
         "daemon": daemon,
         "graph": graph,
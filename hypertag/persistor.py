@@ -1,11 +1,62 @@
 import os
 import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from typing import List
 from pathlib import Path
 import filetype  # type: ignore
-from fuzzywuzzy import process  # type: ignore
+from rapidfuzz import process, utils as fuzz_utils  # type: ignore
 from .utils import is_int
 
+FILE_GROUPS_TYPES = {
+    "Images": ["jpg", "png", "svg", "tif", "ico", "icns"],
+    "Videos": ["mp4", "gif", "webm", "avi", "mkv"],
+    "Audio": ["mp3", "m4a", "flac", "wav", "wma", "aac", "aa", "aax"],
+    "Documents": ["txt", "md", "rst", "pdf", "epub", "doc", "docx"],
+    "Source Code": [
+        "sh",
+        "py",
+        "pyx",
+        "ipynb",
+        "c",
+        "h",
+        "cpp",
+        "rs",
+        "erl",
+        "ex",
+        "js",
+        "ts",
+        "css",
+        "html",
+        "sql",
+    ],
+    "Configs": ["yml", "xml", "conf", "ini", "toml", "json", "lock"],
+    "Archives": [
+        "zip",
+        "gz",
+        "xz",
+        "z",
+        "sz",
+        "lz",
+        "bz2",
+        "tar",
+        "iso",
+        "7z",
+        "rar",
+    ],
+    "Blobs": ["bin", "pyc", "so", "o", "ar", "a", "lib", "rmeta", "jar", "exe"],
+    "Misc": ["ll", "d", "tag", "blend", "map"],
+}
+FILE_TYPES_GROUPS = {
+    file_type: group for group, types in FILE_GROUPS_TYPES.items() for file_type in types
+}
+# Extensions (and MIME subtype aliases like jpeg) that filetype can detect from magic bytes
+FILETYPE_EXTENSIONS = frozenset(
+    name.lower() for kind in filetype.types for name in (kind.extension, kind.mime.split("/")[-1])
+)
+# Max bound variables per "IN (?, ...)" list (SQLite < 3.32 allows 999 per statement)
+MAX_IN_VARIABLES = 900
+
 
 class Persistor:
     """SQLite3 DB persistence class"""
@@ -18,52 +69,34 @@ class Persistor:
         self.hypertagfs_name = "HyperTagFS"
         self.ignore_list_name = "ignore_list"
         self.ignore_list = ["node_modules", "__pycache__"]
-        self.conn = sqlite3.connect(str(path))
+        self.vector_dtype_name = "vector_dtype"
+        self.vector_dtypes = ("fp16", "fp32", "int8")  # First is the default of new databases
+        self.schema_seeded_name = "schema_seeded"
+        self.schema_version = 1  # Stored as PRAGMA user_version, bump on schema changes
+        self.tag_ids = dict()  # Cache: tag name -> tag_id
+        self.file_ids = dict()  # Cache: file path -> file_id
+        self.meta_values = dict()  # Cache: meta name -> value
+        self.data_version = None  # PRAGMA data_version the caches above were filled at
+        self.commit_depth = 0  # Nesting level of commit_context
+        self.conn = sqlite3.connect(str(path), cached_statements=256)
         self.c = self.conn.cursor()
-        self.file_groups_types = {
-            "Images": ["jpg", "png", "svg", "tif", "ico", "icns"],
-            "Videos": ["mp4", "gif", "webm", "avi", "mkv"],
-            "Audio": ["mp3", "m4a", "flac", "wav", "wma", "aac", "aa", "aax"],
-            "Documents": ["txt", "md", "rst", "pdf", "epub", "doc", "docx"],
-            "Source Code": [
-                "sh",
-                "py",
-                "pyx",
-                "ipynb",
-                "c",
-                "h",
-                "cpp",
-                "rs",
-                "erl",
-                "ex",
-                "js",
-                "ts",
-                "css",
-                "html",
-                "sql",
-            ],
-            "Configs": ["yml", "xml", "conf", "ini", "toml", "json", "lock"],
-            "Archives": [
-                "zip",
-                "gz",
-                "xz",
-                "z",
-                "sz",
-                "lz",
-                "bz2",
-                "tar",
-                "iso",
-                "7z",
-                "rar",
-            ],
-            "Blobs": ["bin", "pyc", "so", "o", "ar", "a", "lib", "rmeta", "jar", "exe"],
-            "Misc": ["ll", "d", "tag", "blend", "map"],
-        }
-        self.file_types_groups = dict()
-        for group, types in self.file_groups_types.items():
-            for file_type in types:
-                self.file_types_groups[file_type] = group
-
+        # WAL + NORMAL sync: no fsync per commit, readers don't block the writer
+        self.c.execute("PRAGMA journal_mode=WAL")
+        self.c.execute("PRAGMA synchronous=NORMAL")
+        self.c.execute("PRAGMA temp_store=MEMORY")
+        self.c.execute("PRAGMA cache_size=-65536")  # 64 MiB page cache
+        self.c.execute("PRAGMA mmap_size=268435456")
+        self.c.execute("PRAGMA foreign_keys=ON")
+        self.file_groups_types = FILE_GROUPS_TYPES
+        self.file_types_groups = FILE_TYPES_GROUPS
+        # Bootstrap schema only when the database predates the current schema version
+        self.c.execute("PRAGMA user_version")
+        if self.c.fetchone()[0] < self.schema_version:
+            self.bootstrap_schema()
+
+    def bootstrap_schema(self):
+        # Create / migrate tables & indexes and seed tags in one transaction
+        self.c.execute("BEGIN")
         self.c.execute(
             """
             CREATE TABLE IF NOT EXISTS
@@ -74,6 +107,13 @@ class Persistor:
             )
             """
         )
+        # Databases that already hold files keep their fp32 vectors, new ones use the default
+        vector_dtype = self.vector_dtypes[0]
+        self.c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'files'")
+        if self.c.fetchone() is not None:
+            self.c.execute("SELECT EXISTS(SELECT 1 FROM files)")
+            if self.c.fetchone()[0]:
+                vector_dtype = "fp32"
         self.c.executemany(
             """
             INSERT OR IGNORE INTO meta(
@@ -85,6 +125,7 @@ class Persistor:
             [
                 (self.hypertagfs_dir, str(Path.home() / self.hypertagfs_name)),
                 (self.ignore_list_name, ",".join(self.ignore_list)),
+                (self.vector_dtype_name, vector_dtype),
             ],
         )
 
@@ -182,15 +223,58 @@ class Persistor:
         except sqlite3.OperationalError:
             pass
 
-        for group, types in self.file_groups_types.items():
-            self.add_tag(group)
-            for file_type in types:
-                self.add_tag(file_type)
-                self.add_parent_tag_to_tag(group, file_type)
+        # Lookup indexes (tag_id / parent_tag_id lookups use the composite primary keys)
+        self.c.execute("CREATE INDEX IF NOT EXISTS idx_files_name ON files(name)")
+        # Covering (file_id, tag_id) index for file -> tags lookups (replaces file_id only index)
+        self.c.execute("DROP INDEX IF EXISTS idx_tags_files_file")
+        self.c.execute(
+            "CREATE INDEX IF NOT EXISTS idx_tags_files_file_tag ON tags_files(file_id, tag_id)"
+        )
+        self.c.execute(
+            "CREATE INDEX IF NOT EXISTS idx_tags_tags_children ON tags_tags(children_tag_id)"
+        )
+        # Partial indexes holding only files still waiting to be indexed / vectorized
+        self.c.execute(
+            "CREATE INDEX IF NOT EXISTS idx_files_unindexed ON files(file_id) WHERE indexed IS NULL"
+        )
+        self.c.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_files_unvectorized ON files(path)
+            WHERE embedding_vector IS NULL AND clean_text IS NULL
+            """
+        )
 
+        # Seed file type & group tags once (skipped on later startups)
+        self.c.execute("SELECT value FROM meta WHERE name = ?", [self.schema_seeded_name])
+        if self.c.fetchone() is None:
+            self.c.executemany(
+                "INSERT OR IGNORE INTO tags(name) VALUES(?)",
+                [
+                    (name,)
+                    for group, types in self.file_groups_types.items()
+                    for name in [group] + types
+                ],
+            )
+            self.c.executemany(
+                """
+                INSERT OR IGNORE INTO tags_tags(
+                    parent_tag_id,
+                    children_tag_id
+                )
+                SELECT p.tag_id, t.tag_id FROM tags p, tags t
+                WHERE p.name = ? AND t.name = ?
+                """,
+                [(group, file_type) for file_type, group in self.file_types_groups.items()],
+            )
+            self.c.execute(
+                "INSERT INTO meta(name, value) VALUES(?, ?)", [self.schema_seeded_name, "1"]
+            )
+
+        self.c.execute(f"PRAGMA user_version = {self.schema_version}")
         self.conn.commit()
 
     def close(self):
+        self.c.execute("PRAGMA optimize")  # Refresh query planner statistics
         self.c.close()
         self.conn.close()
 
@@ -202,6 +286,54 @@ class Persistor:
         """Destructor: closes connection and cursor"""
         self.close()
 
+    @contextmanager
+    def commit_context(self):
+        """Run writes in one explicit transaction: commit on success, rollback on error
+        (commits of mutators inside are deferred, nested contexts join the outermost)"""
+        outermost = self.commit_depth == 0
+        if outermost and not self.conn.in_transaction:
+            self.c.execute("BEGIN IMMEDIATE")
+            self.sync_id_caches()
+        self.commit_depth += 1
+        try:
+            yield
+        except BaseException:
+            if outermost:
+                self.conn.rollback()
+                self.clear_id_caches()
+            raise
+        finally:
+            self.commit_depth -= 1
+        if outermost:
+            self.conn.commit()
+
+    def commit(self):
+        # Commit unless inside a commit_context (which commits once at its end)
+        if self.commit_depth == 0:
+            self.conn.commit()
+
+    def clear_id_caches(self):
+        self.tag_ids.clear()
+        self.file_ids.clear()
+        self.meta_values.clear()
+
+    def sync_id_caches(self):
+        # Other connections (daemon, web API) may have deleted cached tags / files:
+        # PRAGMA data_version changes whenever another connection commits
+        data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version != self.data_version:
+            self.data_version = data_version
+            self.clear_id_caches()
+
+    def get_meta_value(self, name: str):
+        # Meta values only change through the setters below, which invalidate the cache
+        if not self.conn.in_transaction:
+            self.sync_id_caches()
+        if name not in self.meta_values:
+            self.c.execute("SELECT value FROM meta WHERE name = ?", (name,))
+            self.meta_values[name] = self.c.fetchone()[0]
+        return self.meta_values[name]
+
     def set_hypertagfs_dir(self, path: str):
         self.c.execute(
             """
@@ -213,31 +345,33 @@ class Persistor:
             """,
             [str(Path(path) / self.hypertagfs_name), self.hypertagfs_dir],
         )
-        self.conn.commit()
+        self.commit()
+        self.meta_values.pop(self.hypertagfs_dir, None)
 
     def get_hypertagfs_dir(self):
-        self.c.execute(
-            """
-            SELECT value
-            FROM meta
-            WHERE name = ?
-            """,
-            (self.hypertagfs_dir,),
-        )
-        data = self.c.fetchone()[0]
-        return data
+        return self.get_meta_value(self.hypertagfs_dir)
 
     def get_ignore_list(self):
+        return self.get_meta_value(self.ignore_list_name).split(",")
+
+    def set_vector_dtype(self, vector_dtype: str):
+        if vector_dtype not in self.vector_dtypes:
+            raise ValueError(f"Unsupported vector dtype {vector_dtype!r} {self.vector_dtypes}")
         self.c.execute(
             """
-            SELECT value
-            FROM meta
-            WHERE name = ?
+            UPDATE meta
+            SET
+                value = ?
+            WHERE
+                name = ?
             """,
-            (self.ignore_list_name,),
+            [vector_dtype, self.vector_dtype_name],
         )
-        data = self.c.fetchone()[0].split(",")
-        return data
+        self.commit()
+        self.meta_values.pop(self.vector_dtype_name, None)
+
+    def get_vector_dtype(self):
+        return self.get_meta_value(self.vector_dtype_name)
 
     def add_text(self, name, text):
         self.c.execute(
@@ -253,23 +387,38 @@ class Persistor:
         self.c.execute(
             "SELECT name FROM texts WHERE texts MATCH ? ORDER BY rank LIMIT ?", [query_text, top_k]
         )
-        data = [e[0] for e in self.c.fetchall()]
+        data = [e[0] for e in self.c]
         return data
 
-    def add_file(self, path: str):
-        file_path = Path(path)
-        file_name = file_path.name
-        file_type_guess = filetype.guess(str(file_path))
-        if file_type_guess is None:
-            file_name_splits = file_name.split(".")
-            candidate_file_type = file_name_splits[-1].lower()
-            if len(file_name_splits) > 1 and len(candidate_file_type) < 7:
-                file_type = candidate_file_type
-            else:
-                file_type = ""
+    def get_file_type_tags(self, file_path: Path):
+        # Returns file type and file group tag names of file
+        _head, has_ext, candidate_file_type = file_path.name.rpartition(".")
+        candidate_file_type = candidate_file_type.lower()
+        if has_ext and candidate_file_type in self.file_types_groups:
+            file_type = candidate_file_type  # Known extension: skip reading the file header
         else:
-            file_type = file_type_guess.extension
+            if has_ext and candidate_file_type not in FILETYPE_EXTENSIONS:
+                file_type_guess = None  # Unrecognizable by magic bytes: skip reading the header
+            else:
+                file_type_guess = filetype.guess(str(file_path))
+            if file_type_guess is None:
+                if has_ext and len(candidate_file_type) < 7:
+                    file_type = candidate_file_type
+                else:
+                    file_type = ""
+            else:
+                file_type = file_type_guess.extension
+
+        tag_names = []
+        if has_ext and file_type:
+            tag_names.append(file_type)
+        file_group = self.file_types_groups.get(file_type)
+        if file_group:
+            tag_names.append(file_group)
+        return tag_names
 
+    def add_file(self, path: str):
+        file_path = Path(path)
         self.c.execute(
             """
             INSERT INTO files(
@@ -278,25 +427,88 @@ class Persistor:
             )
             VALUES(?, ?)
             """,
-            (file_name, str(file_path)),
+            (file_path.name, str(file_path)),
         )
-        if len(file_name.split(".")) > 1 and file_type:
-            self.add_tag_to_file(file_type, str(file_path))
-        file_group = self.file_types_groups.get(file_type)
-        if file_group:
-            self.add_tag_to_file(file_group, str(file_path))
+        file_id = self.c.lastrowid
+        self.file_ids[str(file_path)] = file_id
+        tag_names = self.get_file_type_tags(file_path)
+        self.add_tags_to_file_ids([(self.add_tag(name), file_id, None) for name in tag_names])
+
+    def add_files_bulk(self, paths: List[str], chunk_size=2000, max_workers=8):
+        # Insert files & their file type tags in chunks, returns paths of newly added files
+        paths = list(dict.fromkeys(str(path) for path in paths))
+        added_paths = []
+        for i in range(0, len(paths), MAX_IN_VARIABLES):
+            chunk = paths[i : i + MAX_IN_VARIABLES]
+            self.c.execute(
+                "SELECT path FROM files WHERE path IN (" + ",".join("?" * len(chunk)) + ")",
+                chunk,
+            )
+            existing_paths = {e[0] for e in self.c}
+            added_paths += [path for path in chunk if path not in existing_paths]
 
-    def add_tag(self, name: str):
-        self.c.execute(
-            """
-            INSERT OR IGNORE INTO tags(
-                name
+        # Classify files (may read file headers) before writing, overlapping the file reads
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            file_type_tags = list(
+                executor.map(self.get_file_type_tags, [Path(path) for path in added_paths])
             )
-            VALUES(?)
-            """,
-            [name],
-        )
-        tag_id = self.get_tag_id_by_name(name)
+
+        tag_ids = dict()
+        tags_files = []
+        for path, tag_names in zip(added_paths, file_type_tags):
+            for tag_name in tag_names:
+                if tag_name not in tag_ids:
+                    tag_ids[tag_name] = self.add_tag(tag_name)
+                tags_files.append((tag_ids[tag_name], path))
+        for i in range(0, len(added_paths), chunk_size):
+            self.c.executemany(
+                """
+                INSERT OR IGNORE INTO files(
+                    name,
+                    path
+                )
+                VALUES(?, ?)
+                """,
+                [(Path(path).name, path) for path in added_paths[i : i + chunk_size]],
+            )
+        for i in range(0, len(tags_files), chunk_size):
+            self.c.executemany(
+                """
+                INSERT OR IGNORE INTO tags_files(
+                    tag_id,
+                    file_id
+                )
+                SELECT ?, file_id FROM files WHERE path = ?
+                """,
+                tags_files[i : i + chunk_size],
+            )
+        return added_paths
+
+    def add_tag(self, name: str):
+        if not self.conn.in_transaction:  # Else other connections can't commit meanwhile
+            self.sync_id_caches()
+        tag_id = self.tag_ids.get(name)
+        if tag_id is None:
+            # Existing tags are only read, the (write locking) insert runs for new tags only
+            self.c.execute("SELECT tag_id FROM tags WHERE name = ?", [name])
+            tag = self.c.fetchone()
+            if tag is None:
+                self.c.execute(
+                    """
+                    INSERT OR IGNORE INTO tags(
+                        name
+                    )
+                    VALUES(?)
+                    """,
+                    [name],
+                )
+                if self.c.rowcount == 1:
+                    tag = (self.c.lastrowid,)
+                else:  # Inserted by another connection meanwhile
+                    self.c.execute("SELECT tag_id FROM tags WHERE name = ?", [name])
+                    tag = self.c.fetchone()
+            tag_id = tag[0]
+            self.tag_ids[name] = tag_id
         return tag_id
 
     def add_auto_import_directory(self, path: str, auto_index_images: bool, auto_index_text: bool):
@@ -313,24 +525,24 @@ class Persistor:
             [path, int(auto_index_images), int(auto_index_text)],
         )
         auto_import_dir_id = self.get_auto_import_id_by_path(path)
-        self.conn.commit()
+        self.commit()
         return auto_import_dir_id
 
     def get_auto_index_images(self, path):
         self.c.execute(
-            "SELECT auto_index_images FROM auto_import_directories WHERE path LIKE ?", [path]
+            "SELECT auto_index_images FROM auto_import_directories WHERE path = ?", [path]
         )
         return bool(self.c.fetchone()[0])
 
     def get_auto_index_texts(self, path):
         self.c.execute(
-            "SELECT auto_index_texts FROM auto_import_directories WHERE path LIKE ?", [path]
+            "SELECT auto_index_texts FROM auto_import_directories WHERE path = ?", [path]
         )
         return bool(self.c.fetchone()[0])
 
     def update_file_by_id(self, file_id: int, file_path: str):
         file_path = str(file_path)
-        file_name = file_path.split("/")[-1]
+        file_name = file_path.rpartition("/")[2]
         self.c.execute(
             """
             UPDATE files
@@ -342,9 +554,11 @@ class Persistor:
             """,
             [file_name, file_path, file_id],
         )
-        self.conn.commit()
+        self.commit()
+        self.file_ids.clear()
 
-    def add_file_embedding_vector(self, file_path: str, embedding_vector: str):
+    def add_file_embedding_vector(self, file_path: str, embedding_vector):
+        # embedding_vector: raw vector bytes (BLOB) or JSON text marker for unparseable files
         self.c.execute(
             """
             UPDATE OR IGNORE files
@@ -353,32 +567,45 @@ class Persistor:
             WHERE
                 path = ?
             """,
-            [str(embedding_vector), file_path],
+            [embedding_vector, file_path],
         )
 
-    def get_file_embedding_vectors(self, file_paths):
-        # Returns list of (file_id, embedding_vector)
-        file_embedding_vectors = []
-        for file_path in file_paths:
+    def get_file_embedding_vectors(self, file_paths, chunk_size=MAX_IN_VARIABLES):
+        # Returns list of (path, embedding_vector) in order of file_paths
+        file_paths = [str(file_path) for file_path in file_paths]
+        embedding_vectors = dict()
+        for i in range(0, len(file_paths), chunk_size):
+            chunk = file_paths[i : i + chunk_size]
             self.c.execute(
                 """
                 SELECT path, embedding_vector
                 FROM files
                 WHERE embedding_vector IS NOT NULL AND
-                    path = ?
-                """,
-                (str(file_path),),
+                    embedding_vector != 'nan' AND
+                    path IN ("""
+                + ",".join("?" * len(chunk))
+                + ")",
+                chunk,
             )
-            result = self.c.fetchone()
-            if result:
-                path, embedding_vector = result
-                if embedding_vector != "nan":
-                    file_embedding_vectors.append((path, embedding_vector))
-        return file_embedding_vectors
+            embedding_vectors.update(self.c)
+        return [(path, embedding_vectors[path]) for path in file_paths if path in embedding_vectors]
+
+    def get_all_file_embedding_vectors(self):
+        # Returns list of (path, embedding_vector) of all vectorized files
+        self.c.execute(
+            """
+            SELECT path, embedding_vector
+            FROM files
+            WHERE embedding_vector IS NOT NULL AND
+                embedding_vector != 'nan'
+            ORDER BY file_id
+            """
+        )
+        return self.c.fetchall()
 
     def set_indexed_by_file_paths(self, file_paths: List[str]):
-        for file_path in file_paths:
-            self.c.execute(
+        with self.commit_context():
+            self.c.executemany(
                 """
                 UPDATE files
                 SET
@@ -386,63 +613,89 @@ class Persistor:
                 WHERE
                     path = ?
                 """,
-                [file_path],
+                [(file_path,) for file_path in file_paths],
             )
-        self.conn.commit()
 
     def get_unindexed_file_paths(self, show_path=True):
         if show_path:
             head = "SELECT path"
         else:
             head = "SELECT name"
-        self.c.execute(head + " FROM files WHERE indexed is NULL")
-        data = [e[0] for e in self.c.fetchall()]
+        # In file_id order: new index labels must follow the order of the search corpus
+        self.c.execute(head + " FROM files WHERE indexed is NULL ORDER BY file_id")
+        data = [e[0] for e in self.c]
         return data
 
-    def get_vectorized_file_paths(self, show_path=True):
+    def get_vectorized_file_paths(self, show_path=True, stream=False):
         if show_path:
             head = "SELECT path"
         else:
             head = "SELECT name"
-        self.c.execute(head + " FROM files WHERE embedding_vector is NOT NULL")
-        data = [e[0] for e in self.c.fetchall()]
+        query = head + " FROM files WHERE embedding_vector is NOT NULL"
+        if stream:  # Lazily iterate rows on a dedicated cursor
+            return (e[0] for e in self.conn.execute(query))
+        self.c.execute(query)
+        data = [e[0] for e in self.c]
         return data
 
     def get_unvectorized_file_paths(self) -> List[str]:
         self.c.execute(
             "SELECT path FROM files WHERE embedding_vector is NULL AND clean_text is NULL"
         )
-        data = [str(e[0]) for e in self.c.fetchall()]
+        data = [str(e[0]) for e in self.c]
         return data
 
-    def get_files(self, show_path, include_id=False):
-        q_suffix = " FROM files" if include_id else " FROM files"
+    def get_files(self, show_path, include_id=False, stream=False):
         if show_path:
-            self.c.execute("SELECT file_id, path" + q_suffix)
+            query = "SELECT file_id, path FROM files"
         else:
-            self.c.execute("SELECT file_id, name" + q_suffix)
+            query = "SELECT file_id, name FROM files"
+        if stream:  # Lazily iterate rows on a dedicated cursor
+            rows = self.conn.execute(query)
+            return rows if include_id else (e[1] for e in rows)
+        self.c.execute(query)
         if include_id:
             data = self.c.fetchall()
         else:
-            data = [e[0] for e in self.c.fetchall()]
+            data = [e[1] for e in self.c]
         return data
 
     def get_files_by_name(self, name_query):
         self.c.execute("SELECT file_id FROM files WHERE name LIKE ?", ["%" + name_query + "%"])
-        return [list(i) for i in self.c.fetchall()]
+        return [list(i) for i in self.c]
 
     def add_tag_to_file(self, tag_name_or_id: str, file_name_or_path: str, value=None):
-        if is_int(tag_name_or_id):
-            tag_id = int(tag_name_or_id)
-        else:
-            tag_id = self.add_tag(tag_name_or_id)
+        self.add_tags_to_files([(tag_name_or_id, file_name_or_path, value)])
+
+    def add_tags_to_files(self, tags_files):
+        # tags_files: list of (tag_name_or_id, file_name_or_path, value), inserted in one batch
+        rows = []
+        for tag_name_or_id, file_name_or_path, value in tags_files:
+            if is_int(tag_name_or_id):
+                tag_id = int(tag_name_or_id)
+            else:
+                tag_id = self.add_tag(tag_name_or_id)
 
-        if "/" in file_name_or_path:
-            file_id = self.get_file_id_by_path(file_name_or_path)
-        else:
-            file_id = self.get_file_id_by_name(file_name_or_path)
+            if "/" in file_name_or_path:
+                file_id = self.get_file_id_by_path(file_name_or_path)
+            else:
+                file_id = self.get_file_id_by_name(file_name_or_path)
+            rows.append((tag_id, file_id, value))
+        self.add_tags_to_file_ids(rows)
 
-        self.add_tag_to_file_id(tag_id, file_id, value)
+    def add_tags_to_file_ids(self, tag_ids_file_ids):
+        # tag_ids_file_ids: list of pre-resolved (tag_id, file_id, value)
+        self.c.executemany(
+            """
+            INSERT OR IGNORE INTO tags_files(
+                tag_id,
+                file_id,
+                value
+            )
+            VALUES(?, ?, ?)
+            """,
+            tag_ids_file_ids,
+        )
 
     def add_tag_to_file_id(self, tag_name_or_id, file_id, value=None):
         if is_int(tag_name_or_id):
@@ -469,35 +722,46 @@ class Persistor:
         except TypeError:
             return
         self.c.execute("DELETE FROM tags_files WHERE file_id = ? AND tag_id = ?", [file_id, tag_id])
-        self.conn.commit()
+        self.commit()
 
     def get_tag_name_by_id(self, tag_id: int):
         self.c.execute("SELECT name FROM tags WHERE tag_id = ?", [tag_id])
         return self.c.fetchone()[0]
 
     def get_tag_id_by_name(self, name: str):
-        self.c.execute("SELECT tag_id FROM tags WHERE name LIKE ?", [name])
-        return self.c.fetchone()[0]
+        if not self.conn.in_transaction:
+            self.sync_id_caches()
+        tag_id = self.tag_ids.get(name)
+        if tag_id is None:
+            self.c.execute("SELECT tag_id FROM tags WHERE name = ?", [name])
+            tag_id = self.c.fetchone()[0]
+            self.tag_ids[name] = tag_id
+        return tag_id
 
     def get_parent_tag_ids_by_name(self, tag_name: str):
         self.c.execute(
             """
         SELECT tt.parent_tag_id
         FROM tags as t, tags_tags as tt
-        WHERE tt.children_tag_id = t.tag_id AND name LIKE ?""",
+        WHERE tt.children_tag_id = t.tag_id AND name = ?""",
             [tag_name],
         )
-        return [e[0] for e in self.c.fetchall()]
+        return [e[0] for e in self.c]
 
     def get_file_id_by_path(self, path: str):
-        self.c.execute("SELECT file_id FROM files WHERE path LIKE ?", [path])
-        path = self.c.fetchone()
-        if path:
-            path = path[0]
-        return path
+        if not self.conn.in_transaction:
+            self.sync_id_caches()
+        file_id = self.file_ids.get(path)
+        if file_id is None:
+            self.c.execute("SELECT file_id FROM files WHERE path = ?", [path])
+            file_id = self.c.fetchone()
+            if file_id:
+                file_id = file_id[0]
+                self.file_ids[path] = file_id
+        return file_id
 
     def get_file_id_by_name(self, name: str):
-        self.c.execute("SELECT file_id FROM files WHERE name LIKE ?", [name])
+        self.c.execute("SELECT file_id FROM files WHERE name = ?", [name])
         return self.c.fetchone()[0]
 
     def get_file_name_by_id(self, file_id: int):
@@ -509,12 +773,12 @@ class Persistor:
         return self.c.fetchone()[0]
 
     def get_auto_import_id_by_path(self, path: str):
-        self.c.execute("SELECT id FROM auto_import_directories WHERE path LIKE ?", [path])
+        self.c.execute("SELECT id FROM auto_import_directories WHERE path = ?", [path])
         return self.c.fetchone()[0]
 
     def get_auto_import_paths(self):
         self.c.execute("SELECT path FROM auto_import_directories")
-        return [e[0] for e in self.c.fetchall()]
+        return [e[0] for e in self.c]
 
     def remove_parent_tag_from_tag(self, parent_tag_name: str, tag_name: str):
         try:
@@ -528,18 +792,31 @@ class Persistor:
             WHERE parent_tag_id = ? AND children_tag_id = ?""",
             [parent_tag_id, tag_id],
         )
-        self.conn.commit()
+        self.commit()
 
     def get_clean_text_of_file(self, file_path: str):
         self.c.execute(
             """
-            SELECT clean_text FROM files WHERE path LIKE ?
+            SELECT clean_text FROM files WHERE path = ?
             """,
             (file_path,),
         )
         data = self.c.fetchone()[0]
         return data
 
+    def get_clean_texts_of_files(self, file_paths, chunk_size=MAX_IN_VARIABLES):
+        # Yields (path, clean_text) of files with a saved clean text (one chunk in memory)
+        file_paths = [str(file_path) for file_path in file_paths]
+        for i in range(0, len(file_paths), chunk_size):
+            chunk = file_paths[i : i + chunk_size]
+            self.c.execute(
+                "SELECT path, clean_text FROM files WHERE clean_text IS NOT NULL AND path IN ("
+                + ",".join("?" * len(chunk))
+                + ")",
+                chunk,
+            )
+            yield from self.c.fetchall()
+
     def add_clean_text_to_file(self, file_path: str, clean_text: str):
         self.c.execute(
             """
@@ -551,24 +828,21 @@ class Persistor:
             """,
             [clean_text, file_path],
         )
-        self.conn.commit()
+        self.commit()
+
+    def add_clean_texts(self, file_paths_clean_texts):
+        # file_paths_clean_texts: iterable of (file_path, clean_text), committed once
+        self.c.executemany(
+            "UPDATE files SET clean_text = ? WHERE path = ?",
+            ((clean_text, str(file_path)) for file_path, clean_text in file_paths_clean_texts),
+        )
+        self.commit()
 
     def add_parent_tag_to_tag(self, parent_tag_name: str, tag_name: str):
         if parent_tag_name.lower() == tag_name.lower():
             return
-        self.c.execute(
-            """
-            INSERT OR IGNORE INTO tags(
-                name
-            )
-            VALUES(?)
-            """,
-            [parent_tag_name],
-        )
-
-        parent_tag_id = self.get_tag_id_by_name(parent_tag_name)
-        self.add_tag(tag_name)
-        tag_id = self.get_tag_id_by_name(tag_name)
+        parent_tag_id = self.add_tag(parent_tag_name)
+        tag_id = self.add_tag(tag_name)
 
         self.c.execute(
             """
@@ -585,7 +859,8 @@ class Persistor:
         file_id = self.get_file_id_by_name(file_name)
         self.c.execute("DELETE FROM tags_files WHERE file_id = ?", [file_id])
         self.c.execute("DELETE FROM files WHERE file_id = ?", [file_id])
-        self.conn.commit()
+        self.commit()
+        self.file_ids.clear()
 
     def remove_tag(self, tag_name):
         # Remove all tag associations
@@ -594,50 +869,64 @@ class Persistor:
         self.c.execute("DELETE FROM tags_tags WHERE parent_tag_id = ?", [tag_id])
         self.c.execute("DELETE FROM tags_tags WHERE children_tag_id = ?", [tag_id])
         self.c.execute("DELETE FROM tags WHERE tag_id = ?", [tag_id])
-        self.conn.commit()
+        self.commit()
+        self.tag_ids.clear()
 
     def merge_tags(self, tag_a, tag_b):
-        tag_a_id = self.get_tag_id_by_name(tag_a)
-        tag_b_id = self.get_tag_id_by_name(tag_b)
-        # Replace tag file associations
-        self.c.execute(
-            """
-            UPDATE OR IGNORE tags_files
-            SET
-                tag_id = ?
-            WHERE
-                tag_id = ?
-            """,
-            [tag_b_id, tag_a_id],
-        )
-        # Replace metatag associations
-        self.c.execute(
-            """
-            UPDATE OR IGNORE tags_tags
-            SET
-                parent_tag_id = ?
-            WHERE
-                parent_tag_id = ?
-            """,
-            [tag_b_id, tag_a_id],
-        )
-        self.c.execute(
-            """
-            UPDATE OR IGNORE tags_tags
-            SET
-                children_tag_id = ?
-            WHERE
-                children_tag_id = ?
-            """,
-            [tag_b_id, tag_a_id],
-        )
-        self.remove_tag(tag_a)  # Commits
+        with self.commit_context():
+            tag_a_id = self.get_tag_id_by_name(tag_a)
+            tag_b_id = self.get_tag_id_by_name(tag_b)
+            # Copy tag file associations (existing ones of tag_b are kept)
+            self.c.execute(
+                """
+                INSERT OR IGNORE INTO tags_files(
+                    tag_id,
+                    file_id,
+                    value
+                )
+                SELECT ?, file_id, value FROM tags_files WHERE tag_id = ?
+                """,
+                [tag_b_id, tag_a_id],
+            )
+            # Copy metatag associations (skipping self references of tag_b)
+            self.c.execute(
+                """
+                INSERT OR IGNORE INTO tags_tags(
+                    parent_tag_id,
+                    children_tag_id
+                )
+                SELECT ?, children_tag_id FROM tags_tags
+                WHERE parent_tag_id = ? AND children_tag_id != ?
+                """,
+                [tag_b_id, tag_a_id, tag_b_id],
+            )
+            self.c.execute(
+                """
+                INSERT OR IGNORE INTO tags_tags(
+                    parent_tag_id,
+                    children_tag_id
+                )
+                SELECT parent_tag_id, ? FROM tags_tags
+                WHERE children_tag_id = ? AND parent_tag_id != ?
+                """,
+                [tag_b_id, tag_a_id, tag_b_id],
+            )
+            # Delete tag_a and its remaining associations
+            self.c.execute("DELETE FROM tags_files WHERE tag_id = ?", [tag_a_id])
+            self.c.execute(
+                "DELETE FROM tags_tags WHERE parent_tag_id = ? OR children_tag_id = ?",
+                [tag_a_id, tag_a_id],
+            )
+            self.c.execute("DELETE FROM tags WHERE tag_id = ?", [tag_a_id])
+        self.tag_ids.clear()
 
     def get_root_tag_ids_names(self):
         self.c.execute(
             """
-            SELECT tag_id, name FROM tags WHERE tag_id NOT IN
-            (SELECT children_tag_id FROM tags_tags)
+            SELECT t.tag_id, t.name
+            FROM tags t
+            LEFT JOIN tags_tags tt ON t.tag_id = tt.children_tag_id
+            WHERE tt.children_tag_id IS NULL
             """
         )
         data = self.c.fetchall()
@@ -646,8 +935,10 @@ class Persistor:
     def get_leaf_tag_ids(self):
         self.c.execute(
             """
-            SELECT tag_id, name FROM tags WHERE tag_id NOT IN
-            (SELECT parent_tag_id FROM tags_tags)
+            SELECT t.tag_id, t.name
+            FROM tags t
+            LEFT JOIN tags_tags tt ON t.tag_id = tt.parent_tag_id
+            WHERE tt.parent_tag_id IS NULL
             """
         )
         data = self.c.fetchall()
@@ -664,58 +955,81 @@ class Persistor:
         data = self.c.fetchall()
         return data
 
-    def get_tags(self):
+    def get_full_tag_tree(self):
+        # Returns list of (parent_tag_id, tag_id, name) of all metatag associations
         self.c.execute(
             """
+            SELECT tt.parent_tag_id, t.tag_id, t.name
+            FROM tags t
+            JOIN tags_tags tt ON t.tag_id = tt.children_tag_id
+            """
+        )
+        data = self.c.fetchall()
+        return data
+
+    def get_all_tag_files(self):
+        # Returns list of (tag_id, path, name) of all tag file associations
+        self.c.execute(
+            """
+            SELECT tf.tag_id, f.path, f.name
+            FROM tags_files tf
+            JOIN files f ON f.file_id = tf.file_id
+            """
+        )
+        data = self.c.fetchall()
+        return data
+
+    def get_tags(self, stream=False):
+        query = """
             SELECT name
             FROM tags
             """
-        )
-        data = [e[0] for e in self.c.fetchall()]
+        if stream:  # Lazily iterate rows on a dedicated cursor
+            return (e[0] for e in self.conn.execute(query))
+        self.c.execute(query)
+        data = [e[0] for e in self.c]
         return data
 
     def get_meta_tags_by_tag_name(self, tag_name):
         self.c.execute(
             """
-            SELECT tt.parent_tag_id
-            FROM tags as t, tags_tags as tt
+            SELECT p.name
+            FROM tags as t, tags_tags as tt, tags as p
             WHERE
                 tt.children_tag_id = t.tag_id AND
-                t.name LIKE ?
+                tt.parent_tag_id = p.tag_id AND
+                t.name = ?
             """,
             (tag_name,),
         )
-        data = [self.get_tag_name_by_id(e[0]) for e in self.c.fetchall()]
+        data = [e[0] for e in self.c]
         return data
 
     def get_tags_by_file_id(self, file_id):
         self.c.execute(
             """
             SELECT t.name
-            FROM tags as t, tags_files as tf, files as f
-            WHERE
-                t.tag_id = tf.tag_id AND
-                tf.file_id = f.file_id AND
-                f.file_id = ?
+            FROM tags_files tf
+            JOIN tags t ON t.tag_id = tf.tag_id
+            WHERE tf.file_id = ?
             """,
             (file_id,),
         )
-        data = [e[0] for e in self.c.fetchall()]
+        data = [e[0] for e in self.c]
         return data
 
     def get_tags_by_file_name(self, file_name):
         self.c.execute(
             """
             SELECT t.name
-            FROM tags as t, tags_files as tf, files as f
-            WHERE
-                t.tag_id = tf.tag_id AND
-                tf.file_id = f.file_id AND
-                f.name LIKE ?
+            FROM files f
+            JOIN tags_files tf ON tf.file_id = f.file_id
+            JOIN tags t ON t.tag_id = tf.tag_id
+            WHERE f.name = ?
             """,
             (file_name,),
         )
-        data = [e[0] for e in self.c.fetchall()]
+        data = [e[0] for e in self.c]
         return data
 
     def get_file_paths_names_by_tag_id_shallow(self, tag_id):
@@ -723,51 +1037,100 @@ class Persistor:
         self.c.execute(
             """
             SELECT f.path, f.name
-            FROM files f, tags t, tags_files tf
-            WHERE f.file_id = tf.file_id AND
-                tf.tag_id = t.tag_id AND
-                t.tag_id = ?
+            FROM tags_files tf
+            JOIN files f ON f.file_id = tf.file_id
+            WHERE tf.tag_id = ?
             """,
             [tag_id],
         )
         data = self.c.fetchall()
         return data
 
-    def get_file_paths_names_by_tag_id(self, tag_id, files_data=[]):
-        # Recursively includes all children tags files
+    def get_file_paths_names_by_tag_id(self, tag_id):
+        # Includes all files of tag id and its children tags (recursively)
         self.c.execute(
             """
-            SELECT f.path, f.name
-            FROM files f, tags t, tags_files tf
-            WHERE f.file_id = tf.file_id AND
-                tf.tag_id = t.tag_id AND
-                t.tag_id = ?
+            WITH RECURSIVE sub_tags(tag_id) AS (
+                SELECT ?
+                UNION
+                SELECT tt.children_tag_id
+                FROM tags_tags tt
+                JOIN sub_tags st ON tt.parent_tag_id = st.tag_id
+            )
+            SELECT DISTINCT f.path, f.name
+            FROM sub_tags st
+            JOIN tags_files tf ON tf.tag_id = st.tag_id
+            JOIN files f ON f.file_id = tf.file_id
             """,
             [tag_id],
         )
-        data = self.c.fetchall() + files_data
+        data = self.c.fetchall()
+        return data
 
-        children_tuples = self.get_tag_id_children_ids_names(tag_id)
-        for child_tag_id, _name in children_tuples:
-            data = self.get_file_paths_names_by_tag_id(child_tag_id, data)
+    def get_fuzzy_tag_name(self, tag_name, tag_names=None, verbose=False):
+        # Returns best matching existing tag name
+        if tag_names is None:
+            tag_names = self.get_tags()
+        matches = process.extract(
+            tag_name, tag_names, processor=fuzz_utils.default_process, limit=5
+        )
+        best_match = None, None
+        best_dist = float("inf")
+        tag_name_chars = frozenset(tag_name)
+        for match, ratio, _index in matches:
+            length_dist = abs(len(match) - len(tag_name)) + 1
+            length_overlap = len(tag_name_chars.intersection(match))
+            dist = ((length_dist**0.5) / ((length_overlap + 1) ** 3)) / (0.0001 + ratio)
+            if dist < best_dist:
+                best_dist = dist
+                best_match = match, ratio
+
+        tag_name, ratio = best_match
+        if verbose:
+            print(f"Fuzzy matched: {tag_name} ({best_dist*100:.5f})")
+        return tag_name
+
+    def get_files_by_tag_query(self, tag_queries, show_path, fuzzy, verbose=False):
+        # tag_queries: list of (operand, tag_name, value), operand of first entry is ignored
+        # Set operations run in SQLite on file ids (compound selects evaluate left to right)
+        set_operators = {"and": "INTERSECT", "or": "UNION", "minus": "EXCEPT"}
+        tag_names = self.get_tags() if fuzzy else None
+        # Fuzzy matches are existing tag names: seek them exactly via the unique index
+        name_match = "=" if fuzzy else "LIKE"
+        sub_queries = []
+        bindings = []
+        for i, (operand, tag_name, value) in enumerate(tag_queries):
+            if fuzzy:
+                tag_name = self.get_fuzzy_tag_name(tag_name, tag_names, verbose)
+            sub_query = f"""
+                SELECT tf.file_id
+                FROM tags_files tf, tags t
+                WHERE tf.tag_id = t.tag_id AND
+                    t.name {name_match} ?
+                """
+            bindings.append(tag_name)
+            if value:
+                sub_query += "AND tf.value LIKE ? "
+                bindings.append(value)
+            if i > 0:
+                sub_queries.append(set_operators[operand])
+            sub_queries.append(sub_query)
+        if show_path:
+            select = "SELECT f.path"
+        else:
+            select = "SELECT DISTINCT f.name"
+        self.c.execute(
+            select + " FROM files f WHERE f.file_id IN (" + "".join(sub_queries) + ")",
+            bindings,
+        )
+        data = [e[0] for e in self.c]
         return data
 
     def get_files_by_tag(self, tag_name, show_path, fuzzy, value=None, verbose=False):
+        name_match = "LIKE"
         if fuzzy:
-            matches = process.extract(tag_name, self.get_tags(), limit=5)
-            best_match = None, None
-            best_dist = float("inf")
-            for match, ratio in matches:
-                length_dist = abs(len(match) - len(tag_name)) + 1
-                length_overlap = len(set(tag_name).intersection(match))
-                dist = ((length_dist**0.5) / ((length_overlap + 1) ** 3)) / (0.0001 + ratio)
-                if dist < best_dist:
-                    best_dist = dist
-                    best_match = match, ratio
-
-            tag_name, ratio = best_match
-            if verbose:
-                print(f"Fuzzy matched: {tag_name} ({best_dist*100:.5f})")
+            tag_name = self.get_fuzzy_tag_name(tag_name, verbose=verbose)
+            name_match = "="  # Exact existing tag name
         if show_path:
             select = "SELECT f.path"
         else:
@@ -779,14 +1142,14 @@ class Persistor:
             bindings = [tag_name, value]
         self.c.execute(
             select
-            + """
+            + f"""
             FROM files f, tags t, tags_files tf
             WHERE f.file_id = tf.file_id AND
                 tf.tag_id = t.tag_id AND
-                t.name LIKE ?
+                t.name {name_match} ?
             """
             + value_q,
             bindings,
         )
-        data = [e[0] for e in self.c.fetchall()]
+        data = [e[0] for e in self.c]
         return data
@@ -1,6 +1,8 @@
 import urllib.request
 from pathlib import Path
+import io
 import os
+import sys
 from shutil import rmtree
 from tqdm import tqdm  # type: ignore
 
@@ -31,42 +33,72 @@ def download_url(url, output_path):
         urllib.request.urlretrieve(url, filename=output_path, reporthook=t.update_to)
 
 
+def write_lines(lines, chunk_size=4096):
+    # Write lines to stdout in chunks of about chunk_size characters
+    buf = io.StringIO()
+    for line in lines:
+        buf.write(str(line))
+        buf.write("\n")
+        if buf.tell() > chunk_size:
+            sys.stdout.write(buf.getvalue())
+            buf = io.StringIO()
+    sys.stdout.write(buf.getvalue())
+
+
+def walk_visible_files(directory, ignore_list):
+    # Yield files (incl. symlinked files) in directory recursively, pruning hidden and ignored
+    # dirs before descending (dir symlinks not followed)
+    stack = [str(directory)]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.name.startswith(".") or entry.name in ignore_list:
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file():
+                    yield Path(entry.path)
+
+
 def remove_dir(directory, del_dir_name):
-    # Delete dirs named del_dir_name in directory recursively
-    for item in directory.iterdir():
-        if item.name == del_dir_name and item.is_dir():
-            rmtree(item)
-        if item.is_dir():
-            remove_dir(item, del_dir_name)
+    # Delete dirs named del_dir_name in directory recursively (deleted trees are not descended)
+    for dir_path, dir_names, _file_names in os.walk(str(directory)):
+        if del_dir_name in dir_names:
+            rmtree(os.path.join(dir_path, del_dir_name))
+            dir_names.remove(del_dir_name)
+
+
+def walk_entries(directory):
+    # Yield DirEntry of all non-dir entries in directory recursively (dir symlinks not followed)
+    stack = [str(directory)]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            entries = list(it)  # Listed up front, callers may modify the directory
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(entry.path)
+            else:
+                yield entry
 
 
 def remove_file(directory, file_name):
     # Delete files named file_name in directory recursively
-    directory = Path(directory)
-    for item in directory.iterdir():
-        if item.name == file_name and item.is_file():
-            os.remove(item)
-        if item.is_dir():
-            remove_file(item, file_name)
+    for entry in walk_entries(directory):
+        if entry.name == file_name and entry.is_file():
+            os.remove(entry.path)
 
 
 def remove_symlink(directory, file_name):
     # Delete symlinks named file_name in directory recursively
-    directory = Path(directory)
-    for item in directory.iterdir():
-        if item.name == file_name and item.is_symlink():
-            os.remove(item)
-        if item.is_dir():
-            remove_symlink(item, file_name)
+    for entry in walk_entries(directory):
+        if entry.name == file_name and entry.is_symlink():
+            os.remove(entry.path)
 
 
 def update_symlink(directory, file_name, new_path):
     # Update symlinks named file_name with new_path in directory recursively
-    directory = Path(directory)
-    for item in directory.iterdir():
-        if item.name == file_name and item.is_symlink():
-            temp_link = directory / ("_temp" + file_name)
+    for entry in walk_entries(directory):
+        if entry.name == file_name and entry.is_symlink():
+            temp_link = os.path.join(os.path.dirname(entry.path), "_temp" + file_name)
             os.symlink(new_path, temp_link)
-            os.rename(temp_link, directory / file_name)
-        if item.is_dir():
-            update_symlink(item, file_name, new_path)
+            os.rename(temp_link, entry.path)
@@ -1,12 +1,16 @@
 import os
 import re
 import json
+import string
 import logging
-from typing import Union, Tuple, List
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, Union, Tuple, List, Optional
 from pathlib import Path
 import filetype  # type: ignore
+import numpy as np
 import torch
-from torchvision.transforms import Compose, Resize, CenterCrop, ToTensor  # type: ignore
+from torchvision.transforms import Compose, Resize, CenterCrop  # type: ignore
 from PIL import Image  # type: ignore
 from sentence_transformers import SentenceTransformer  # type: ignore
 import hnswlib  # type: ignore
@@ -20,10 +24,46 @@ from .tokenizer import SimpleTokenizer
 
 logging.disable(logging.INFO)
 
+VECTOR_DTYPES = {"fp32": np.float32, "fp16": np.float16, "int8": np.int8}
+IMAGE_FILE_TYPES = frozenset({"jpg", "png"})
+EXACT_SEARCH_MAX_VECTORS = 10000  # Brute force search up to this corpus size
+# HNSW index parameters ("balanced" hnswlib settings, applied when an index is created)
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF = 50
+IMAGE_EXTENSION_ALIASES = {"jpeg": "jpg", "jpe": "jpg"}
+TEXT_DOCUMENT_TYPES = frozenset(
+    {
+        "pdf",
+        "epub",
+        "doc",
+        "docx",
+        "html",
+        "json",
+        "rtf",
+        "txt",
+        "xls",
+        "xlsx",
+        "ps",
+        "pptx",
+        "odt",
+        "eml",
+        "msg",
+    }
+)
+QUERY_ARGS_REGEX = re.compile(r"\*+'.*?'|\*+\".*?\"|\S+")  # Words, *word, *'quoted words'
+STAR_WORD_REGEX = re.compile(r"\*+\w+")
+# ASCII bytes deleted when cleaning text (all special chars but space . ')
+SPECIAL_CHAR_BYTES = bytes(
+    set(range(128)) - set((string.ascii_letters + string.digits + " .'").encode())
+)
+
 
 class CLIPVectorizer:
     """Multimodal vector space for images and texts powered by OpenAI's CLIP"""
 
+    dim = 512
+
     def __init__(self, cpu=None, verbose=False):
         self.verbose = verbose
         self.device = "cuda" if torch.cuda.is_available() and not cpu else "cpu"
@@ -54,12 +94,14 @@ class CLIPVectorizer:
             else self.model.float().eval()
         )
         self.tokenizer = SimpleTokenizer(bpe_path=str(clip_files_path / tokenizer_name))
+        # Cache: text query -> CLIP text features (repeated queries skip BPE and the model)
+        self.get_text_features = lru_cache(maxsize=128)(self.encode_text)
         input_resolution = self.model.input_resolution.item()
+        self.input_resolution = input_resolution
         self.preprocess = Compose(
             [
                 Resize(input_resolution, interpolation=Image.BICUBIC),
                 CenterCrop(input_resolution),
-                ToTensor(),
             ]
         )
 
@@ -68,10 +110,12 @@ class CLIPVectorizer:
 
         # Build or load index
         corpus_vectors, corpus_paths = self.get_image_corpus()
+        # Reused by searches until the index changes
+        self.corpus = cacheable_corpus(corpus_vectors, corpus_paths)
         index_dir = Path.home() / ".config/hypertag/index-files/"
         self.index_path = index_dir / "images.index"
         os.makedirs(index_dir, exist_ok=True)
-        self.index = hnswlib.Index(space="cosine", dim=512)
+        self.index = hnswlib.Index(space="cosine", dim=self.dim)
 
         if self.index_path.exists():
             if self.verbose:
@@ -80,13 +124,15 @@ class CLIPVectorizer:
             self.update_index()
         else:
             # Create the HNSWLIB index
-            if not corpus_vectors:
+            if len(corpus_vectors) == 0:
                 return
             if self.verbose:
                 print("Creating HNSWLIB image index...")
-            self.index.init_index(max_elements=len(corpus_vectors), ef_construction=400, M=64)
+            self.index.init_index(
+                max_elements=len(corpus_vectors), ef_construction=HNSW_EF_CONSTRUCTION, M=HNSW_M
+            )
             # Train the index to find a suitable clustering
-            self.index.add_items(corpus_vectors, list(range(len(corpus_vectors))))
+            self.index.add_items(corpus_vectors, np.arange(len(corpus_vectors), dtype=np.int64))
             if self.verbose:
                 print("Saving index to:", self.index_path)
             self.index.save_index(str(self.index_path))
@@ -94,54 +140,45 @@ class CLIPVectorizer:
             with Persistor() as db:
                 db.set_indexed_by_file_paths(corpus_paths)
         # Controlling the recall by setting ef (lower is faster but more inaccuare)
-        self.index.set_ef(50)  # ef should always be > top_k_hits
+        self.index.set_ef(HNSW_EF)  # ef should always be > top_k_hits
 
     def update_index(self):
         # Handle new vectorized elements
-        with Persistor() as db:
+        with Persistor() as db:  # One connection for lookup and update
             file_paths = db.get_unindexed_file_paths()
             compatible_files = get_image_files(file_paths)
+            # Kept in file_id order (labels len_old.. must match the corpus rows of search)
             corpus = db.get_file_embedding_vectors(compatible_files)
-        new_corpus_paths = []
-        new_corpus_vectors = []
-        for doc_path, embedding_vector in corpus:
-            new_corpus_vectors.append(json.loads(embedding_vector))
-            new_corpus_paths.append(doc_path)
-        len_new = len(new_corpus_vectors)
-        len_old = self.index.element_count
-        new_total_size = len_old + len_new
-        if self.verbose:
-            print("CURRENT INDEXED FILES:", len_old)
-            print("NEW UNINDEXED FILES:", len_new)
-            print("NEW TOTAL SIZE:", new_total_size)
-        if new_corpus_vectors:
-            # Add unindexed vectors to index
-            self.index.resize_index(new_total_size)
-            new_ids = list(range(len_old, new_total_size))
-            self.index.add_items(
-                new_corpus_vectors,
-                new_ids,
-            )
+            new_corpus_vectors, new_corpus_paths = stack_corpus_vectors(corpus, self.dim)
+            len_new = len(new_corpus_vectors)
+            len_old = self.index.element_count
+            new_total_size = len_old + len_new
             if self.verbose:
-                print("Saving updated index to:", self.index_path)
-            self.index.save_index(str(self.index_path))
-            # Update DB (set files as indexed)
-            with Persistor() as db:
+                print("CURRENT INDEXED FILES:", len_old)
+                print("NEW UNINDEXED FILES:", len_new)
+                print("NEW TOTAL SIZE:", new_total_size)
+            if len_new > 0:
+                self.corpus = None  # Reloaded on next search
+                # Add unindexed vectors to index
+                self.index.resize_index(new_total_size)
+                new_ids = np.arange(len_old, new_total_size, dtype=np.int64)
+                self.index.add_items(
+                    new_corpus_vectors,
+                    new_ids,
+                )
+                if self.verbose:
+                    print("Saving updated index to:", self.index_path)
+                self.index.save_index(str(self.index_path))
+                # Update DB (set files as indexed)
                 db.set_indexed_by_file_paths(new_corpus_paths)
 
     def get_image_corpus(self):
         # Retrieve vectorized image vectors and paths
         with Persistor() as db:
-            file_paths = db.get_vectorized_file_paths()
-            compatible_files = get_image_files(file_paths)
-            corpus = db.get_file_embedding_vectors(compatible_files)
-
-        corpus_paths = []
-        corpus_vectors = []
-        for doc_path, embedding_vector in corpus:
-            corpus_vectors.append(json.loads(embedding_vector))
-            corpus_paths.append(doc_path)
-        return corpus_vectors, corpus_paths
+            corpus = db.get_all_file_embedding_vectors()
+        image_paths = set(get_image_files([path for path, _vector in corpus]))
+        corpus = [(path, vector) for path, vector in corpus if path in image_paths]
+        return stack_corpus_vectors(corpus, self.dim)
 
     def search_image(self, text_query: str, path, top_k, score):
         query_vector = None
@@ -149,19 +186,26 @@ class CLIPVectorizer:
         file_path = Path(text_query)
         if file_path.exists() and file_path.is_file():
             file_type_guess = filetype.guess(str(file_path))
-            if file_type_guess and file_type_guess.extension in {"jpg", "png"}:
+            if file_type_guess and file_type_guess.extension in IMAGE_FILE_TYPES:
                 query_vector = self.encode_image(str(file_path))
 
-        corpus_vectors, corpus_paths = self.get_image_corpus()
-        image_features = torch.Tensor(corpus_vectors)
-        image_features /= image_features.norm(dim=-1, keepdim=True)
+        if self.corpus is None:
+            self.corpus = cacheable_corpus(*self.get_image_corpus())
+        corpus_vectors, corpus_paths = self.corpus
 
         # Encode text query
         if query_vector is None:
-            query_vector = self.encode_text(text_query)
-        query_vector /= query_vector.norm(dim=-1, keepdim=True)
-        # Indexed top-k nearest neighbor query
-        corpus_ids, distances = self.index.knn_query(query_vector.cpu(), k=top_k)
+            query_vector = self.get_text_features(text_query)
+        query_vector = query_vector / query_vector.norm(dim=-1, keepdim=True)  # Keeps cache intact
+        if len(corpus_paths) <= max(top_k, EXACT_SEARCH_MAX_VECTORS):
+            # Exact query: one matrix-vector product is cheap for small corpora
+            # (and HNSWLIB can not return more neighbors than it holds)
+            if corpus_vectors is None:  # Not cached (large corpus), read back from the index
+                corpus_vectors = get_index_vectors(self.index, len(corpus_paths))
+            corpus_ids, distances = exact_knn_query(corpus_vectors, query_vector.cpu(), top_k)
+        else:
+            # Indexed top-k nearest neighbor query
+            corpus_ids, distances = self.index.knn_query(query_vector.cpu(), k=top_k)
         # Print results
         results = []
         for corpus_id, score_value in zip(corpus_ids[0], distances[0]):
@@ -178,11 +222,21 @@ class CLIPVectorizer:
                 print(file_name)
         return results
 
+    def load_image(self, path: str):
+        image = Image.open(path)
+        # JPEGs: let the decoder downscale (never below the model's input resolution)
+        image.draft("RGB", (self.input_resolution, self.input_resolution))
+        image = self.preprocess(image.convert("RGB"))
+        # uint8 CHW tensor (scaled & normalized on the device, a quarter of the float32 bytes)
+        return torch.from_numpy(np.array(image)).permute(2, 0, 1)
+
     def encode_image(self, path: str):
-        image = Image.open(path).convert("RGB")
-        image = self.preprocess(image)
-        image.unsqueeze_(0)
-        image_input = image.to(self.device)
+        return self.encode_images([path])
+
+    def encode_images(self, paths: List[str]):
+        # Encode a batch of images in one forward pass (returns one row per path)
+        image_input = torch.stack([self.load_image(path) for path in paths]).to(self.device)
+        image_input = image_input.float().div_(255)
         image_input -= self.image_mean[:, None, None]
         image_input /= self.image_std[:, None, None]
         with torch.no_grad():
@@ -193,13 +247,10 @@ class CLIPVectorizer:
         sot_token = self.tokenizer.encoder["<|startoftext|>"]
         eot_token = self.tokenizer.encoder["<|endoftext|>"]
         text_token = self.tokenizer.encode(text)
-        text_tokens = [[sot_token] + text_token + [eot_token]]
-        text_input = torch.zeros(len(text_tokens), self.model.context_length, dtype=torch.long)
-
-        for i, tokens in enumerate(text_tokens):
-            text_input[i, : len(tokens)] = torch.tensor(tokens)
-
-        text_input = text_input.to(self.device)
+        tokens = [sot_token] + text_token + [eot_token]
+        # Zero padded to the context length, built directly on the device
+        padding = [0] * (self.model.context_length - len(tokens))
+        text_input = torch.tensor([tokens + padding], dtype=torch.long, device=self.device)
 
         with torch.no_grad():
             text_features = self.model.encode_text(text_input).float()
@@ -207,18 +258,24 @@ class CLIPVectorizer:
 
 
 class TextVectorizer:
+    dim = 768
+
     def __init__(self, verbose=False):
         self.verbose = verbose
         os.environ["TOKENIZERS_PARALLELISM"] = "true"
         model_name = "stsb-distilbert-base"
         self.model = SentenceTransformer(model_name)
+        # Cache: parsed text query -> query vector (repeated queries skip the model)
+        self.get_query_vector = lru_cache(maxsize=128)(self.compute_query_vector)
 
         # Build or load index
         corpus_vectors, corpus_paths = self.get_text_corpus()
+        # Reused by searches until the index changes
+        self.corpus = cacheable_corpus(corpus_vectors, corpus_paths)
         index_dir = Path.home() / ".config/hypertag/index-files/"
         self.index_path = index_dir / "texts.index"
         os.makedirs(index_dir, exist_ok=True)
-        self.index = hnswlib.Index(space="cosine", dim=768)
+        self.index = hnswlib.Index(space="cosine", dim=self.dim)
 
         if self.index_path.exists():
             if self.verbose:
@@ -227,13 +284,15 @@ class TextVectorizer:
             self.update_index()
         else:
             # Create the HNSWLIB index
-            if not corpus_vectors:
+            if len(corpus_vectors) == 0:
                 return
             if self.verbose:
                 print("Creating HNSWLIB text index...")
-            self.index.init_index(max_elements=len(corpus_vectors), ef_construction=400, M=64)
+            self.index.init_index(
+                max_elements=len(corpus_vectors), ef_construction=HNSW_EF_CONSTRUCTION, M=HNSW_M
+            )
             # Then we train the index to find a suitable clustering
-            self.index.add_items(corpus_vectors, list(range(len(corpus_vectors))))
+            self.index.add_items(corpus_vectors, np.arange(len(corpus_vectors), dtype=np.int64))
             if self.verbose:
                 print("Saving index to:", self.index_path)
             self.index.save_index(str(self.index_path))
@@ -241,90 +300,114 @@ class TextVectorizer:
             with Persistor() as db:
                 db.set_indexed_by_file_paths(corpus_paths)
         # Controlling the recall by setting ef (lower is faster but more inaccuare)
-        self.index.set_ef(50)  # ef should always be > top_k_hits
+        self.index.set_ef(HNSW_EF)  # ef should always be > top_k_hits
 
     def update_index(self):
         # Handle new vectorized elements
-        with Persistor() as db:
+        with Persistor() as db:  # One connection for lookup and update
             file_paths = db.get_unindexed_file_paths()
             compatible_files = [p for p, _t in get_text_documents(file_paths)]
+            # Kept in file_id order (labels len_old.. must match the corpus rows of search)
             corpus = db.get_file_embedding_vectors(compatible_files)
-        new_corpus_paths = []
-        new_corpus_vectors = []
-        for doc_path, embedding_vector in corpus:
-            new_corpus_vectors.append(json.loads(embedding_vector))
-            new_corpus_paths.append(doc_path)
-        len_new = len(new_corpus_vectors)
-        len_old = self.index.element_count
-        new_total_size = len_old + len_new
-        if self.verbose:
-            print("CURRENT INDEXED FILES:", len_old)
-            print("NEW UNINDEXED FILES:", len_new)
-            print("NEW TOTAL SIZE:", new_total_size)
-        if new_corpus_vectors:
-            # Add unindexed vectors to index
-            self.index.resize_index(new_total_size)
-            new_ids = list(range(len_old, new_total_size))
-            self.index.add_items(
-                new_corpus_vectors,
-                new_ids,
-            )
+            new_corpus_vectors, new_corpus_paths = stack_corpus_vectors(corpus, self.dim)
+            len_new = len(new_corpus_vectors)
+            len_old = self.index.element_count
+            new_total_size = len_old + len_new
             if self.verbose:
-                print("Saving updated index to:", self.index_path)
-            self.index.save_index(str(self.index_path))
-            # Update DB (set files as indexed)
-            with Persistor() as db:
+                print("CURRENT INDEXED FILES:", len_old)
+                print("NEW UNINDEXED FILES:", len_new)
+                print("NEW TOTAL SIZE:", new_total_size)
+            if len_new > 0:
+                self.corpus = None  # Reloaded on next search
+                # Add unindexed vectors to index
+                self.index.resize_index(new_total_size)
+                new_ids = np.arange(len_old, new_total_size, dtype=np.int64)
+                self.index.add_items(
+                    new_corpus_vectors,
+                    new_ids,
+                )
+                if self.verbose:
+                    print("Saving updated index to:", self.index_path)
+                self.index.save_index(str(self.index_path))
+                # Update DB (set files as indexed)
                 db.set_indexed_by_file_paths(new_corpus_paths)
 
     def get_text_corpus(self):
         # Returns text paths and embedding vectors
         with Persistor() as db:
-            text_files = [fp for _id, fp in db.get_files(show_path=True, include_id=True)]
-        text_document_tuples = get_text_documents(text_files)
-        text_document_paths = [path for path, _file_type in text_document_tuples]
-        with Persistor() as db:
-            corpus = db.get_file_embedding_vectors(text_document_paths)
-        corpus_paths = []
-        corpus_vectors = []
-        for doc_path, embedding_vector in corpus:
-            corpus_vectors.append(json.loads(embedding_vector))
-            corpus_paths.append(doc_path)
-        return corpus_vectors, corpus_paths
+            corpus = db.get_all_file_embedding_vectors()
+        text_document_tuples = get_text_documents([path for path, _vector in corpus])
+        text_document_paths = {path for path, _file_type in text_document_tuples}
+        corpus = [(path, vector) for path, vector in corpus if path in text_document_paths]
+        return stack_corpus_vectors(corpus, self.dim)
 
     def compute_text_embedding(self, sentences: List[List[str]]) -> List[float]:
         for i, s in enumerate(sentences):
             if len(s) == 1:
                 sentences[i] = 2 * sentences[i]  # Needed for transformer model
+        if not sentences:
+            return []  # Treated as unparseable by callers
         sentence_vectors = self.model.encode(sentences, show_progress_bar=False)
-        if sentence_vectors.shape[0] > 0:
-            return torch.Tensor(sentence_vectors.mean(axis=0)).tolist()
-        else:
-            return torch.Tensor([sentence_vectors]).tolist()
+        return sentence_vectors.mean(axis=0).tolist()
+
+    def compute_query_vector(self, parsed_text_query: str) -> List[float]:
+        return self.compute_text_embedding(clean_transform(parsed_text_query, 0, 1))
+
+    def compute_text_embeddings(
+        self, documents: List[List[List[str]]], batch_size: int = 256
+    ) -> List[List[float]]:
+        # Encode each unique sentence of all documents once, then average them per document
+        sentence_ids: Dict[Tuple[str, ...], int] = dict()
+        document_sentence_ids = []
+        for sentences in documents:
+            # Single word sentences are duplicated (needed for transformer model)
+            document_sentence_ids.append(
+                [
+                    sentence_ids.setdefault(tuple(2 * s if len(s) == 1 else s), len(sentence_ids))
+                    for s in sentences
+                ]
+            )
+        if not sentence_ids:
+            return [[] for _ in documents]
+        sentence_vectors = self.model.encode(
+            [list(s) for s in sentence_ids], batch_size=batch_size, show_progress_bar=False
+        )
+        return [
+            sentence_vectors[ids].mean(axis=0).tolist() if ids else []
+            for ids in document_sentence_ids
+        ]
 
     def search(self, text_query: str, path=False, top_k=10, score=False, verbose=True):
         """Execute a semantic search that returns best matching text documents"""
         # Parse query: duplicate words marked with * (increases search weight)
-        parsed_query = []
-        rex = re.compile(r"\*+\w+")
-        args = re.findall(r"\*+'.*?'|\*+\".*?\"|\S+", text_query)
-
-        for w in args:
-            if w.startswith("*"):
-                w = w.replace('"', "").replace("'", "")
-                matches = rex.search(w)
-                if matches:
-                    replicate_n = matches.group().count("*")
-                    for _ in range(replicate_n + 1):
-                        parsed_query.append(w[replicate_n:])
-            else:
-                parsed_query.append(w)
-        parsed_text_query = " ".join(parsed_query)
-        corpus_vectors, corpus_paths = self.get_text_corpus()
-
-        sentence_query = clean_transform(parsed_text_query, 0, 1)
-        query_vector = self.compute_text_embedding(sentence_query)
-        # Indexed top-k nearest neighbor query
-        corpus_ids, distances = self.index.knn_query(query_vector, k=top_k)
+        if "*" not in text_query:  # No weights: words as they are
+            parsed_text_query = " ".join(text_query.split())
+        else:
+            parsed_query = []
+            for w in QUERY_ARGS_REGEX.findall(text_query):
+                if w.startswith("*"):
+                    w = w.replace('"', "").replace("'", "")
+                    matches = STAR_WORD_REGEX.search(w)
+                    if matches:
+                        replicate_n = matches.group().count("*")
+                        parsed_query.extend([w[replicate_n:]] * (replicate_n + 1))
+                else:
+                    parsed_query.append(w)
+            parsed_text_query = " ".join(parsed_query)
+        if self.corpus is None:
+            self.corpus = cacheable_corpus(*self.get_text_corpus())
+        corpus_vectors, corpus_paths = self.corpus
+
+        query_vector = self.get_query_vector(parsed_text_query)
+        if len(corpus_paths) <= max(top_k, EXACT_SEARCH_MAX_VECTORS):
+            # Exact query: one matrix-vector product is cheap for small corpora
+            # (and HNSWLIB can not return more neighbors than it holds)
+            if corpus_vectors is None:  # Not cached (large corpus), read back from the index
+                corpus_vectors = get_index_vectors(self.index, len(corpus_paths))
+            corpus_ids, distances = exact_knn_query(corpus_vectors, query_vector, top_k)
+        else:
+            # Indexed top-k nearest neighbor query
+            corpus_ids, distances = self.index.knn_query(query_vector, k=top_k)
 
         results = []
         for corpus_id, score_value in zip(corpus_ids[0], distances[0]):
@@ -344,87 +427,149 @@ class TextVectorizer:
         return results
 
 
+def encode_vector(vector, vector_dtype: str = "fp32") -> bytes:
+    # Serialize embedding vector to raw bytes (stored as BLOB)
+    vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+    if vector_dtype == "int8":
+        # Symmetric per-vector quantization: fp32 scale followed by the int8 values
+        scale = np.float32(np.abs(vector).max() / 127 or 1)
+        return scale.tobytes() + np.round(vector / scale).astype(np.int8).tobytes()
+    return vector.astype(VECTOR_DTYPES[vector_dtype]).tobytes()
+
+
+def decode_vector(embedding_vector: Union[bytes, str], dim: int) -> np.ndarray:
+    # Legacy rows hold JSON text, BLOB rows raw fp32 / fp16 / scaled int8 bytes (told apart by size)
+    if isinstance(embedding_vector, str):
+        return np.asarray(json.loads(embedding_vector), dtype=np.float32)
+    if len(embedding_vector) == dim + 4:
+        scale = np.frombuffer(embedding_vector[:4], dtype=np.float32)[0]
+        return np.frombuffer(embedding_vector[4:], dtype=np.int8).astype(np.float32) * scale
+    item_size, remainder = divmod(len(embedding_vector), dim)
+    dtype = {4: np.float32, 2: np.float16}.get(item_size)
+    if remainder or dtype is None:
+        return np.empty(0, dtype=np.float32)
+    return np.frombuffer(embedding_vector, dtype=dtype).astype(np.float32)
+
+
+def stack_corpus_vectors(corpus, dim: int) -> Tuple[np.ndarray, List[str]]:
+    # Decode (path, embedding_vector) rows into one preallocated float32 matrix
+    corpus = [(path, decode_vector(vector, dim)) for path, vector in corpus]
+    corpus = [(path, vector) for path, vector in corpus if len(vector) == dim]
+    corpus_vectors = np.empty((len(corpus), dim), dtype=np.float32)
+    corpus_paths = []
+    for i, (doc_path, vector) in enumerate(corpus):
+        corpus_vectors[i] = vector
+        corpus_paths.append(doc_path)
+    return corpus_vectors, corpus_paths
+
+
+def cacheable_corpus(
+    corpus_vectors: np.ndarray, corpus_paths: List[str]
+) -> Tuple[Optional[np.ndarray], List[str]]:
+    # Vectors are only needed for exact queries: larger corpora are searched through the
+    # HNSW index (which holds its own copy), so only their paths are kept in memory
+    if len(corpus_paths) > EXACT_SEARCH_MAX_VECTORS:
+        return None, corpus_paths
+    return corpus_vectors, corpus_paths
+
+
+def get_index_vectors(index, n: int) -> np.ndarray:
+    # Vectors of labels 0..n-1 (row i of the corpus is stored under label i)
+    return np.asarray(index.get_items(np.arange(n, dtype=np.int64)), dtype=np.float32)
+
+
+def top_k_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+    # Indices of the top_k highest scores, best first (partition in O(N), sort only top_k)
+    top_k = min(top_k, len(scores))
+    if top_k <= 0:
+        return np.empty(0, dtype=np.int64)
+    indices = np.argpartition(-scores, top_k - 1)[:top_k]
+    return indices[np.argsort(-scores[indices])]
+
+
+def exact_knn_query(corpus_vectors: np.ndarray, query_vector, top_k: int):
+    # Brute force cosine k-NN, same output layout as hnswlib's knn_query
+    query_vector = np.asarray(query_vector, dtype=np.float32).reshape(-1)
+    norms = np.linalg.norm(corpus_vectors, axis=1) * np.linalg.norm(query_vector)
+    similarities = corpus_vectors @ query_vector / np.maximum(norms, 1e-12)
+    corpus_ids = top_k_indices(similarities, top_k)
+    return corpus_ids[None, :], 1 - similarities[corpus_ids][None, :]
+
+
+def guess_file_type(file_path) -> Optional[str]:
+    # Lowercased extension guessed from the file's magic bytes (None if unknown / unreadable)
+    try:
+        file_type_guess = filetype.guess(str(file_path))
+    except OSError:
+        return None
+    return file_type_guess.extension.lower() if file_type_guess else None
+
+
+def guess_file_types(file_paths, max_workers=8) -> List[Optional[str]]:
+    # Sniff file headers concurrently (I/O bound, file reads release the GIL)
+    if len(file_paths) < 2:
+        return [guess_file_type(file_path) for file_path in file_paths]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(guess_file_type, file_paths, chunksize=64))
+
+
+def get_file_types(file_paths: List[str]) -> List[Optional[str]]:
+    # Lowercased file extensions (extension is sufficient, sniff magic bytes only if missing)
+    file_types = [os.path.splitext(file_path)[1][1:].lower() for file_path in file_paths]
+    unknown = [i for i, file_type in enumerate(file_types) if not file_type]
+    for i, file_type in zip(unknown, guess_file_types([file_paths[i] for i in unknown])):
+        file_types[i] = file_type
+    return file_types
+
+
 def get_image_files(file_paths, verbose=False):
     # Keep only images (JPG)
-    doc_types = {"jpg", "png"}
+    doc_types = IMAGE_FILE_TYPES
     if verbose:
-        print("Supported image file types:", doc_types)
+        print("Supported image file types:", set(doc_types))
+    file_paths = list(file_paths)
+    file_types = get_file_types(file_paths)
     compatible_files = []
-    for file_path in file_paths:
-        file_type_guess = filetype.guess(str(file_path))
-        if file_type_guess is None:
-            continue
-        file_type = file_type_guess.extension.lower()
-        if file_type in doc_types:
+    for file_path, file_type in zip(file_paths, file_types):
+        if IMAGE_EXTENSION_ALIASES.get(file_type, file_type) in doc_types:
             compatible_files.append(str(file_path))
     return compatible_files
 
 
 def get_text_documents(file_paths: List[str], verbose=False) -> List[Tuple[str, str]]:
     # TODO: Add markdown support
-    doc_types = {
-        "pdf",
-        "epub",
-        "doc",
-        "docx",
-        "html",
-        "json",
-        "rtf",
-        "txt",
-        "xls",
-        "xlsx",
-        "ps",
-        "pptx",
-        "odt",
-        "eml",
-        "msg",
-    }
+    doc_types = TEXT_DOCUMENT_TYPES
     if verbose:
-        print("Supported text file types:", doc_types)
+        print("Supported text file types:", set(doc_types))
     # Keep only text files
+    file_types = get_file_types(file_paths)
     compatible_files = []
-    for file_path in file_paths:
-        file_type_guess = filetype.guess(str(file_path))
-        if file_type_guess is None:
-            file_name = file_path.split("/")[-1]
-            name_parts = file_name.split(".")
-            if len(name_parts) > 1 and len(name_parts[-1]) < 6:
-                file_type = name_parts[-1]
-            else:
-                continue
-        else:
-            file_type = file_type_guess.extension.lower()
+    for file_path, file_type in zip(file_paths, file_types):
         if file_type in doc_types:
             compatible_files.append((str(file_path), file_type))
     return compatible_files
 
 
-def extract_clean_text(args: Tuple[str, str, bool, int, int]) -> Tuple[str, List[List[str]]]:
+def extract_clean_text(
+    args: Tuple[str, str, bool, int, int],
+) -> Tuple[str, List[List[str]], Optional[str]]:
+    # Returns (file_path, sentences, clean_text to store or None)
+    # Saved clean texts are read and results stored by the caller in batches
+    # (workers do not open database connections)
     file_path, file_type, cache, min_words, min_word_length = args
-    if cache:
-        with Persistor() as db:
-            # Use saved cleaned text if available (cache)
-            # TODO: Evaluate thoroughly if storing all tokens is worth it
-            # Hunch: Yes, we can store text tokens and a single mapping (token : word)
-            sentences_string = db.get_clean_text_of_file(file_path)
-            if sentences_string is not None:
-                sentences = [s.split(" ") for s in json.loads(sentences_string)]
-                return str(file_path), sentences
-
     text = extract_text(file_path, file_type)
     sentences = []
+    clean_text = None
     if text:
         sentences = clean_transform(text, min_words, min_word_length)
         if cache:
-            with Persistor() as db:
-                # Save cleaned text
-                db.add_clean_text_to_file(file_path, json.dumps([" ".join(s) for s in sentences]))
+            # Save cleaned text
+            clean_text = json.dumps([" ".join(s) for s in sentences])
     else:
-        with Persistor() as db:
-            # Mark as not parseable
-            print("NOT PARSEABLE")
-            db.add_clean_text_to_file(file_path, json.dumps([]))
-    return str(file_path), sentences
+        # Mark as not parseable
+        print("NOT PARSEABLE")
+        clean_text = json.dumps([])
+    return str(file_path), sentences, clean_text
 
 
 def extract_text(file_path_: str, file_type: str) -> str:
@@ -441,28 +586,35 @@ def extract_text(file_path_: str, file_type: str) -> str:
     return text
 
 
+@lru_cache(maxsize=65536)
+def split_word_group(word_group: str) -> Tuple[str, ...]:
+    # Memoized wordninja split (the same glued word groups recur within and across documents)
+    return tuple(wordninja.split(word_group))
+
+
 def clean_transform(text: str, min_words: int, min_word_length: int) -> List[List[str]]:
     text = fix_text(text, normalization="NFKC")
     text = text.replace("\n", " ").replace("\t", " ")
-    text = re.sub("[^A-Za-z0-9 .']+", "", text)  # Remove all special chars but space . '
-    sentences = [s for s in text.split(".") if s]
-
-    ninja_sentences = []
-    for s in sentences:
+    # Drop non ASCII chars, then special ASCII chars (C-level byte translate instead of a regex)
+    text = text.encode("ascii", "ignore").translate(None, SPECIAL_CHAR_BYTES).decode("ascii")
+    # Unique cleaned sentences as word tuples (duplicates removed, first occurrence order kept)
+    ninja_sentences = dict()
+    for s in text.split("."):
+        if not s:
+            continue
         ninja_sentence = []
         for w in s.split(" "):
             if len(w) > 23:  # Words longer than 23 chars are likely missing spaces
-                for nw in wordninja.split(w):  # Split non space seperated word groups up
+                for nw in split_word_group(w):  # Split non space seperated word groups up
                     if len(nw) > min_word_length:
                         ninja_sentence.append(nw)
             else:
                 if len(w) > min_word_length:
                     ninja_sentence.append(w)
-        ninja_sentences.append(ninja_sentence)
-    # Remove duplicates
-    ninja_sentence_set = {" ".join(s) for s in ninja_sentences}
+        ninja_sentences[tuple(ninja_sentence)] = None
 
-    long_sentences = [s.split(" ") for s in ninja_sentence_set if len(s.split(" ")) > min_words]
+    # Sentences without words are kept as one empty word (queries use min_words=0)
+    long_sentences = [list(s or ("",)) for s in ninja_sentences if max(len(s), 1) > min_words]
     return long_sentences
 
 
@@ -486,7 +638,7 @@ def get_pdf_text(file_path: Union[Path, str]) -> str:
 
 
 def get_pypdf_text(file_path: Union[Path, str]) -> str:
-    text = ""
+    page_texts = []  # Joined once at the end
     parsed = 0
     failed = 0
     with open(str(file_path), mode="rb") as f:
@@ -497,8 +649,8 @@ def get_pypdf_text(file_path: Union[Path, str]) -> str:
                     print("Stopping to parse after 42 failed pages...")
                     return ""
                 parsed += 1
-                text += " " + page.extract_text()
+                page_texts.append(" " + page.extract_text())
             except Exception:
                 # print("failed to parse page", parsed)
                 failed += 1
-    return text
+    return "".join(page_texts)
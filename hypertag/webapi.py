@@ -2,6 +2,8 @@ import os
 import sys
 from pathlib import Path
 import json
+import threading
+from contextlib import asynccontextmanager
 import torch
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
@@ -12,48 +14,75 @@ from .vectorizer import TextVectorizer, CLIPVectorizer
 from .daemon import auto_importer, watch_hypertagfs
 
 
-app = FastAPI()
-ht = HyperTag()
+local = threading.local()  # Per server thread state
 text_vectorizer = None
 image_vectorizer = None
+vectorizer_args = (1, None, None)  # (cpu, text, image) as passed to start()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Heavy state is built on server startup (importing this module stays cheap)
+    load_vectorizers(*vectorizer_args)
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.mount("/site", StaticFiles(directory="./hypertag/client", html=True), name="site")
 
 
+def get_ht():
+    # Handlers are sync, so Starlette runs them in its threadpool instead of blocking the
+    # event loop. SQLite connections are bound to their thread: one HyperTag per thread
+    # (kept across requests). Its id caches are dropped per request: the CLI and the daemon
+    # write to the same database meanwhile
+    if not hasattr(local, "ht"):
+        local.ht = HyperTag()
+    local.ht.db.clear_id_caches()
+    return local.ht
+
+
 @app.get("/get_file_name/{fileid}")
-async def get_file_name(fileid: int):
+def get_file_name(fileid: int):
+    ht = get_ht()
     name = ht.db.get_file_name_by_id(fileid)
     print("FILENAME", name)
     return {"result": name}
 
 
 @app.get("/files")
-async def files():
+def files():
+    ht = get_ht()
     return {"files": [[x, y] for y, x in ht.db.get_files(False, True)]}
 
 
 @app.get("/tags")
-async def tags():
+def tags():
+    ht = get_ht()
     return {"tags": ht.show(mode="tags", path=False, print_=False)}
 
 
 @app.get("/get_tags/{file_id}")
-async def get_tags(file_id: int):
+def get_tags(file_id: int):
+    ht = get_ht()
     return {"tags": ht.db.get_tags_by_file_id(file_id)}
 
 
 @app.get("/add_tags/{file_id}/{tag_string}")
-async def add_tags(file_id: int, tag_string: str):
+def add_tags(file_id: int, tag_string: str):
+    ht = get_ht()
     print("Adding", tag_string, "to", file_id)
     for tag in tag_string.split(","):
         clean_tag = tag.strip()
         ht.db.add_tag_to_file_id(clean_tag, file_id)
-    ht.db.conn.commit()
+    ht.db.commit()
     return {"tags": ht.db.get_tags_by_file_id(file_id)}
 
 
 @app.get("/find/{query}")
-async def find(query: str):
+def find(query: str):
+    ht = get_ht()
     query = str(query.replace("$", "/").strip())
     print("FIND:", query)
 
@@ -82,7 +111,8 @@ async def find(query: str):
 
 
 @app.get("/open/{file_id}")
-async def open_(file_id: int):
+def open_(file_id: int):
+    ht = get_ht()
     filepath = Path(ht.db.get_file_path_by_id(file_id))  # convert to path and strip whitespace
 
     # Open the file
@@ -107,12 +137,7 @@ def compute_text_embedding(self, sentences_json):
         return json.dumps(text_vectorizer.compute_text_embedding(sentences))
 
 
-def start(cpu, text, image):
-    # Spawn Auto-Importer threads
-    auto_importer()
-    # Spawn HyperTagFS watch in thread
-    watch_hypertagfs()
-
+def load_vectorizers(cpu, text, image):
     cuda = torch.cuda.is_available()
     if cuda:
         print("CUDA runtime available")
@@ -127,6 +152,17 @@ def start(cpu, text, image):
         global image_vectorizer
         image_vectorizer = CLIPVectorizer(cpu, verbose=True)
 
+
+def start(cpu, text, image):
+    # Spawn Auto-Importer threads
+    auto_importer()
+    # Spawn HyperTagFS watch in thread
+    watch_hypertagfs()
+
+    # Vectorizers are initialized on server startup (see lifespan)
+    global vectorizer_args
+    vectorizer_args = (cpu, text, image)
+
     # HTTP
     port = 23236
     print(
@@ -1,5 +1,192 @@
+import os
 from hypertag import __version__
 
 
 def test_version():
     assert __version__ == __version__
+
+
+def test_mount_duplicate_file_names(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    from hypertag import hypertag
+
+    monkeypatch.setattr(hypertag, "graph", lambda: None)
+    for d in ("a", "b"):
+        (tmp_path / d).mkdir()
+        (tmp_path / d / "x.txt").write_text(d)
+    ht = hypertag.HyperTag()
+    ht.add(str(tmp_path / "a" / "x.txt"), str(tmp_path / "b" / "x.txt"))
+    ht.tag(str(tmp_path / "a" / "x.txt"), str(tmp_path / "b" / "x.txt"), "with", "dupes")
+    ht.db.close()
+    links = {p.name: os.readlink(p) for p in (ht.root_dir / "dupes").iterdir()}
+    assert sorted(links) == ["2-x.txt", "x.txt"]
+    assert sorted(links.values()) == [str(tmp_path / d / "x.txt") for d in ("a", "b")]
+
+
+def test_add_files_bulk(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    from hypertag.persistor import Persistor
+
+    db = Persistor()
+    paths = [str(tmp_path / f"{i}.txt") for i in range(1000)] + [str(tmp_path / "x.py")]
+    assert db.add_files_bulk(paths[:10]) == paths[:10]
+    # More paths than fit into one IN (...) list, already known paths and duplicates
+    added_paths = db.add_files_bulk(paths + paths[5:15] + paths[-1:])
+    db.commit()
+    assert added_paths == paths[10:]
+    db.c.execute("SELECT COUNT(*), COUNT(DISTINCT path) FROM files")
+    assert db.c.fetchone() == (1001, 1001)
+    db.c.execute(
+        """
+        SELECT t.name, COUNT(*) FROM tags_files tf JOIN tags t ON t.tag_id = tf.tag_id
+        GROUP BY t.name
+        """
+    )
+    assert dict(db.c) == {"txt": 1000, "py": 1, "Documents": 1000, "Source Code": 1}
+    assert sorted(db.get_tags_by_file_id(db.get_file_id_by_name("x.py"))) == ["Source Code", "py"]
+    db.close()
+
+
+def test_id_caches_follow_other_connections(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    from hypertag.persistor import Persistor
+
+    db, other_db = Persistor(), Persistor()
+    path = str(tmp_path / "a.txt")
+    db.add_file(path)
+    file_id = db.get_file_id_by_path(path)
+    db.add_tag_to_file_id("t", file_id)
+    db.commit()
+    other_db.remove_tag("t")  # Cached tag_id of "t" is stale in db now
+    db.add_tag_to_file_id("t", file_id)
+    db.commit()
+    assert "t" in db.get_tags_by_file_id(file_id)
+    other_db.remove_file("a.txt")
+    assert db.get_file_id_by_path(path) is None
+    db.close()
+    other_db.close()
+
+
+def test_query(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    from hypertag import hypertag
+
+    monkeypatch.setattr(hypertag, "graph", lambda: None)
+    paths = {}
+    for name in ("a", "b", "c", "d"):
+        paths[name] = tmp_path / f"{name}.txt"
+        paths[name].write_text(name)
+    ht = hypertag.HyperTag()
+    ht.tag(str(paths["a"]), str(paths["b"]), "with", "red", remount=False)
+    ht.tag(str(paths["b"]), str(paths["c"]), "with", "blue", remount=False)
+    ht.tag(str(paths["a"]), "with", "year=2020", remount=False)
+    ht.tag(str(paths["c"]), "with", "year=2021", remount=False)
+    ht.tag(str(paths["d"]), "with", "crimson", remount=False)
+    ht.metatag("red", "crimson", "with", "color", remount=False)
+    assert ht.query("red", fuzzy=False) == {"a.txt", "b.txt"}
+    assert ht.query("red", "blue", fuzzy=False) == {"b.txt"}
+    assert ht.query("red", "and", "blue", fuzzy=False) == {"b.txt"}
+    assert ht.query("red", "or", "blue", fuzzy=False) == {"a.txt", "b.txt", "c.txt"}
+    assert ht.query("red", "minus", "blue", fuzzy=False) == {"a.txt"}
+    # Operands apply left to right: (red or blue) minus year=2021
+    assert ht.query("red", "or", "blue", "minus", "year=2021", fuzzy=False) == {
+        "a.txt",
+        "b.txt",
+    }
+    # Value filters (* is a wildcard) and their combination with other tags
+    assert ht.query("year=2020", fuzzy=False) == {"a.txt"}
+    assert ht.query("year=202*", fuzzy=False) == {"a.txt", "c.txt"}
+    assert ht.query("year=202*", "blue", fuzzy=False) == {"c.txt"}
+    assert ht.query("year=2020", "or", "year=2021", fuzzy=False) == {"a.txt", "c.txt"}
+    # Parent tags match the files of their children tags (also files tagged later)
+    assert ht.query("color", fuzzy=False) == {"a.txt", "b.txt", "d.txt"}
+    assert ht.query("color", "minus", "red", fuzzy=False) == {"d.txt"}
+    ht.tag(str(paths["c"]), "with", "crimson", remount=False)
+    assert ht.query("color", "and", "blue", fuzzy=False) == {"b.txt", "c.txt"}
+    # Fuzzy matching resolves misspelled tag names and paths are returned on request
+    assert ht.query("bleu", "minus", "red") == {"c.txt"}
+    assert ht.query("blue", path=True) == {str(paths["b"]), str(paths["c"])}
+    ht.db.close()
+
+
+def test_merge_tags(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    from hypertag.persistor import Persistor
+
+    db = Persistor()
+    file_ids = {}
+    for name in ("a", "b", "c"):
+        db.add_file(str(tmp_path / f"{name}.txt"))
+        file_ids[name] = db.get_file_id_by_path(str(tmp_path / f"{name}.txt"))
+    db.add_tag_to_file_id("x", file_ids["a"], "1")
+    db.add_tag_to_file_id("x", file_ids["b"])
+    db.add_tag_to_file_id("y", file_ids["b"])
+    db.add_tag_to_file_id("y", file_ids["c"])
+    db.add_parent_tag_to_tag("parent", "x")
+    db.add_parent_tag_to_tag("x", "child")
+    db.add_parent_tag_to_tag("y", "x")  # Would become y -> y
+    db.add_parent_tag_to_tag("x", "y")
+    db.commit()
+    x_id = db.get_tag_id_by_name("x")
+    db.merge_tags("x", "y")
+    assert "x" not in db.tag_ids
+    assert "x" not in db.get_tags()
+    db.c.execute("SELECT COUNT(*) FROM tags_files WHERE tag_id = ?", [x_id])
+    assert db.c.fetchone()[0] == 0
+    # File links of x are moved to y (values kept, overlapping links not duplicated)
+    y_id = db.get_tag_id_by_name("y")
+    db.c.execute("SELECT file_id, value FROM tags_files WHERE tag_id = ? ORDER BY file_id", [y_id])
+    assert db.c.fetchall() == [(file_ids["a"], "1"), (file_ids["b"], None), (file_ids["c"], None)]
+    # Parent and child tags of x are moved to y, without self references
+    db.c.execute(
+        """
+        SELECT p.name, c.name
+        FROM tags_tags tt
+        JOIN tags p ON p.tag_id = tt.parent_tag_id
+        JOIN tags c ON c.tag_id = tt.children_tag_id
+        """
+    )
+    tags_tags = db.c.fetchall()
+    assert all(parent != child for parent, child in tags_tags)
+    assert sorted(e for e in tags_tags if {"parent", "child", "y"} & set(e)) == [
+        ("parent", "y"),
+        ("y", "child"),
+    ]
+    # A new tag x is created instead of linking to the deleted tag id
+    db.add_tag_to_file_id("x", file_ids["c"])
+    db.commit()
+    assert sorted(db.get_tags_by_file_id(file_ids["c"])) == ["Documents", "txt", "x", "y"]
+    db.close()
+
+
+def test_add_tag(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    from hypertag.persistor import Persistor
+
+    db = Persistor()
+    tag_id = db.add_tag("t")
+    db.commit()
+    db.clear_id_caches()
+    total_changes = db.conn.total_changes
+    assert db.add_tag("t") == tag_id
+    assert db.conn.total_changes == total_changes  # Existing tag: read only
+    assert not db.conn.in_transaction
+    assert db.add_tag("u") != tag_id
+    assert db.get_tag_id_by_name("u") == db.add_tag("u")
+    db.close()
+
+
+def test_vector_dtype_of_existing_database(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    from hypertag.persistor import Persistor
+
+    db = Persistor()
+    assert db.get_vector_dtype() == "fp16"
+    db.add_file(str(tmp_path / "a.txt"))
+    db.c.execute("DELETE FROM meta WHERE name = ?", [db.vector_dtype_name])
+    db.c.execute("PRAGMA user_version = 0")  # Database predating vector_dtype
+    db.commit()
+    db.close()
+    db = Persistor()
+    assert db.get_vector_dtype() == "fp32"
+    db.close()
@@ -7,3 +7,42 @@ def test_is_int():
     assert utils.is_int("3.4") is False
     assert utils.is_int("ABC") is False
     assert utils.is_int(3.141) is False
+
+
+def test_write_lines(capsys):
+    utils.write_lines(["a", 2], chunk_size=1)
+    utils.write_lines([])
+    assert capsys.readouterr().out == "a\n2\n"
+
+
+def test_walk_visible_files(tmp_path):
+    (tmp_path / "docs").mkdir()
+    (tmp_path / "docs" / "a.txt").write_text("a")
+    (tmp_path / ".git").mkdir()
+    (tmp_path / ".git" / "HEAD").write_text("ref")
+    (tmp_path / "node_modules").mkdir()
+    (tmp_path / "node_modules" / "b.js").write_text("b")
+    (tmp_path / "c.md").write_text("c")
+    (tmp_path / "link.md").symlink_to(tmp_path / "c.md")
+    (tmp_path / "dir_link").symlink_to(tmp_path / "docs")
+    files = {p.name for p in utils.walk_visible_files(tmp_path, {"node_modules"})}
+    assert files == {"a.txt", "c.md", "link.md"}
+
+
+def test_remove_dir(tmp_path):
+    (tmp_path / "a" / "old" / "old").mkdir(parents=True)
+    (tmp_path / "old" / "b").mkdir(parents=True)
+    (tmp_path / "keep").mkdir()
+    utils.remove_dir(tmp_path, "old")
+    assert sorted(p.name for p in tmp_path.rglob("*")) == ["a", "keep"]
+
+
+def test_update_and_remove_symlink(tmp_path):
+    (tmp_path / "target.txt").write_text("t")
+    (tmp_path / "tag" / "sub").mkdir(parents=True)
+    for link_dir in (tmp_path / "tag", tmp_path / "tag" / "sub"):
+        (link_dir / "f.txt").symlink_to(tmp_path / "missing.txt")
+    utils.update_symlink(tmp_path / "tag", "f.txt", tmp_path / "target.txt")
+    assert (tmp_path / "tag" / "sub" / "f.txt").read_text() == "t"
+    utils.remove_symlink(tmp_path / "tag", "f.txt")
+    assert sorted(p.name for p in (tmp_path / "tag").rglob("*")) == ["sub"]
@@ -0,0 +1,62 @@
+import json
+import numpy as np
+import pytest
+
+vectorizer = pytest.importorskip("hypertag.vectorizer")
+
+
+@pytest.mark.parametrize("vector_dtype, atol", [("fp32", 0), ("fp16", 1e-3), ("int8", 1e-2)])
+def test_encode_decode_vector(vector_dtype, atol):
+    vector = np.linspace(-1, 1, 8, dtype=np.float32)
+    blob = vectorizer.encode_vector(vector, vector_dtype)
+    item_size = {"fp32": 4, "fp16": 2, "int8": 1}[vector_dtype]
+    assert len(blob) == 8 * item_size + (4 if vector_dtype == "int8" else 0)
+    decoded = vectorizer.decode_vector(blob, 8)
+    assert decoded.dtype == np.float32
+    np.testing.assert_allclose(decoded, vector, atol=atol)
+
+
+def test_encode_decode_zero_vector_int8():
+    decoded = vectorizer.decode_vector(vectorizer.encode_vector(np.zeros(8), "int8"), 8)
+    np.testing.assert_array_equal(decoded, np.zeros(8, dtype=np.float32))
+
+
+def test_decode_vector_legacy_json_and_wrong_size():
+    decoded = vectorizer.decode_vector(json.dumps([0.5, -1.0, 2.0]), 3)
+    np.testing.assert_array_equal(decoded, np.array([0.5, -1.0, 2.0], dtype=np.float32))
+    assert len(vectorizer.decode_vector(b"\x00" * 5, 3)) == 0  # Neither fp32, fp16 nor int8
+    assert len(vectorizer.decode_vector(np.zeros(4, np.float32).tobytes(), 3)) == 0
+
+
+def test_stack_corpus_vectors_skips_undecodable_rows():
+    corpus = [
+        ("a", vectorizer.encode_vector([1, 0, 0], "fp32")),
+        ("bad", b"\x00" * 5),
+        ("b", json.dumps([0, 1, 0])),
+        ("short", json.dumps([0, 1])),
+        ("c", vectorizer.encode_vector([0, 0, 1], "fp16")),
+    ]
+    corpus_vectors, corpus_paths = vectorizer.stack_corpus_vectors(corpus, 3)
+    assert corpus_paths == ["a", "b", "c"]
+    assert corpus_vectors.dtype == np.float32
+    np.testing.assert_array_equal(corpus_vectors, np.eye(3, dtype=np.float32))
+
+
+def test_top_k_indices():
+    scores = np.array([0.1, 0.9, -0.5, 0.7, 0.3])
+    assert vectorizer.top_k_indices(scores, 3).tolist() == [1, 3, 4]
+    assert vectorizer.top_k_indices(scores, 10).tolist() == [1, 3, 4, 0, 2]
+    assert vectorizer.top_k_indices(scores, 0).tolist() == []
+    assert vectorizer.top_k_indices(np.empty(0), 3).tolist() == []
+
+
+def test_exact_knn_query():
+    corpus_vectors = np.array([[1, 0], [0, 2], [1, 1], [0, 0]], dtype=np.float32)
+    ids, distances = vectorizer.exact_knn_query(corpus_vectors, [3, 0], 10)
+    assert ids.shape == distances.shape == (1, 4)  # top_k capped to the corpus size
+    assert ids[0][:2].tolist() == [0, 2] and set(ids[0][2:]) == {1, 3}
+    # Cosine distance as in hnswlib (1 - cos), zero vectors are at distance 1
+    np.testing.assert_allclose(distances[0], [0, 1 - np.sqrt(0.5), 1, 1], atol=1e-6)
+    ids, distances = vectorizer.exact_knn_query(corpus_vectors, [0, 0], 2)
+    assert ids.shape == (1, 2)
+    np.testing.assert_allclose(distances[0], [1, 1])